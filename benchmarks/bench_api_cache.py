@@ -0,0 +1,571 @@
+#!/usr/bin/python3
+"""
+Load-test the Redis API cache proxy (docs/oc-api-redis-cache.md) locally.
+
+Extracts proxy.py from the documentation (or takes a given file) and starts
+it against a stub oc-api backend, whose latency and body size per URL follow
+lognormal distributions, and a Redis: a local redis-server when installed,
+else a minimal in-memory stand-in. Client processes then drive Zipf-distributed
+/index/v2 and /meta/v1 traffic at a target rate (open loop, latencies measured
+from the scheduled send time). Each scenario reports throughput, p50/p95/p99
+latency, hit ratio, backend requests, proxy CPU time and peak RSS.
+Results are written as JSON so that runs of different versions can be compared.
+
+Requires the proxy dependencies: pip install "aiohttp>=3.10,<4" "redis[hiredis]>=5.0,<6"
+
+Usage:
+    python3 benchmarks/bench_api_cache.py --rps 2000 --duration 30 --output bench-api-cache.json
+    python3 benchmarks/bench_api_cache.py --scenarios hit-heavy --workers 2 --redis memory
+"""
+import os
+import re
+import sys
+import json
+import math
+import time
+import zlib
+import random
+import shutil
+import signal
+import socket
+import asyncio
+import argparse
+import bisect
+import platform
+import tempfile
+import threading
+import itertools
+import statistics
+import subprocess
+from pathlib import Path
+from collections import Counter, OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+
+import aiohttp
+import hiredis
+from aiohttp import web
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+PROXY_DOC = REPO_ROOT / "docs" / "oc-api-redis-cache.md"
+
+# Traffic and backend shape of each scenario. Bodies and latencies are
+# lognormal (median, sigma); body sizes are fixed per URL, latencies drawn
+# per request. rps_factor scales --rps for scenarios with heavy responses.
+SCENARIOS = {
+    "hit-heavy": {
+        "description": "Small key space warmed before the run: nearly all L1/Redis hits",
+        "keys": 2000, "zipf": 1.1, "warm": True, "rps_factor": 1.0,
+        "body_median": 4 * 1024, "body_sigma": 1.0, "body_max": 512 * 1024,
+        "latency_median": 0.05, "latency_sigma": 0.5,
+    },
+    "miss-heavy": {
+        "description": "One million keys with a flat popularity: mostly misses through to the backend",
+        "keys": 1_000_000, "zipf": 0.6, "warm": False, "rps_factor": 0.5,
+        "body_median": 4 * 1024, "body_sigma": 1.0, "body_max": 512 * 1024,
+        "latency_median": 0.02, "latency_sigma": 0.5,
+    },
+    "large-body": {
+        "description": "Warmed citation lists of megabytes: streaming and decompression of large entries",
+        "keys": 100, "zipf": 1.0, "warm": True, "rps_factor": 0.05,
+        "body_median": 2 * 1024 * 1024, "body_sigma": 0.5, "body_max": 16 * 1024 * 1024,
+        "latency_median": 0.2, "latency_sigma": 0.5,
+    },
+}
+
+# URL shapes by share of the traffic
+ROUTES = (
+    ("/index/v2/citations/doi:{doi}", 35),
+    ("/index/v2/references/doi:{doi}", 25),
+    ("/index/v2/citation-count/doi:{doi}", 15),
+    ("/meta/v1/metadata/doi:{doi}", 25),
+)
+
+CITATION_ROW = ('{{"oci": "06{n}-06{i}", "citing": "omid:br/06{n} doi:{doi}", '
+                '"cited": "omid:br/06{i} doi:10.{i}/x.{n}", "creation": "2020-0{m}", '
+                '"timespan": "P{y}Y{m}M", "journal_sc": "no", "author_sc": "no"}}')
+METADATA_ROW = ('{{"id": "doi:{doi} omid:br/06{n}", "title": "Article {n} on citation data {i}", '
+                '"author": "Doe, Jane [orcid:0000-0002-{i:04d}-{n:04d}]", "pub_date": "2020-0{m}", '
+                '"venue": "Journal {m} [issn:{i:04d}-{m:04d}]", "type": "journal article"}}')
+
+STUB_BODY_CACHE_BYTES = 256 * 1024 * 1024
+CLIENT_CONNECTIONS = 256
+RSS_SAMPLE_INTERVAL = 0.1
+
+
+def free_port():
+    """Return a free TCP port on localhost"""
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def repo_version():
+    """Describe the proxy version being measured"""
+    try:
+        return subprocess.run(["git", "describe", "--always", "--dirty"], cwd=REPO_ROOT,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def extract_proxy(source, target):
+    """Write proxy.py from a .py file or from the '### proxy.py' block of the documentation"""
+    text = Path(source).read_text()
+    if not str(source).endswith(".md"):
+        target.write_text(text)
+        return
+    match = re.search(r"^### proxy\.py\s*\n+```python\n(.*?)^```", text, re.MULTILINE | re.DOTALL)
+    if not match:
+        raise SystemExit(f"No proxy.py source block in {source}")
+    target.write_text(match.group(1))
+
+
+def url_for(rank):
+    """URL of the key with the given popularity rank"""
+    doi = f"{1000 + rank % 9000}/bench.{rank}"
+    slot = rank % sum(share for _, share in ROUTES)
+    for template, share in ROUTES:
+        if slot < share:
+            return template.format(doi=doi)
+        slot -= share
+
+
+def zipf_cumulative(keys, exponent):
+    """Cumulative Zipf weights of ranks 0..keys-1"""
+    return list(itertools.accumulate(1 / (rank + 1) ** exponent for rank in range(keys)))
+
+
+# ---------------------------------------------------------------------------
+# Stub oc-api backend
+# ---------------------------------------------------------------------------
+def make_body(path, size):
+    """JSON array of citation or metadata rows for path, of about `size` bytes"""
+    row = METADATA_ROW if path.startswith("/meta/") else CITATION_ROW
+    doi = path.rsplit("doi:", 1)[-1]
+    seed = zlib.crc32(path.encode())
+    rows, total, i = [], 2, 0
+    while total < size:
+        text = row.format(doi=doi, n=seed % 10000, i=i, m=1 + i % 9, y=i % 30)
+        rows.append(text)
+        total += len(text) + 2
+        i += 1
+    return ("[" + ",\n".join(rows) + "]").encode()
+
+
+def run_stub_backend(port, scenario):
+    """Serve lognormal latencies and per-URL body sizes of the scenario"""
+    cache, cached = OrderedDict(), [0]
+    body_mu, latency_mu = math.log(scenario["body_median"]), math.log(scenario["latency_median"])
+
+    async def handle(request):
+        path = request.path
+        await asyncio.sleep(random.lognormvariate(latency_mu, scenario["latency_sigma"]))
+        body = cache.get(path)
+        if body is None:
+            rnd = random.Random(zlib.crc32(path.encode()))
+            size = min(scenario["body_max"], int(rnd.lognormvariate(body_mu, scenario["body_sigma"])))
+            body = cache[path] = make_body(path, size)
+            cached[0] += len(body)
+            while cached[0] > STUB_BODY_CACHE_BYTES:
+                cached[0] -= len(cache.popitem(last=False)[1])
+        else:
+            cache.move_to_end(path)
+        return web.Response(body=body, content_type="application/json",
+                            headers={"X-Total-Count": str(body.count(b"\n") + 1)})
+
+    app = web.Application()
+    app.router.add_route("*", "/{path:.*}", handle)
+    web.run_app(app, host="127.0.0.1", port=port, print=None, access_log=None)
+
+
+# ---------------------------------------------------------------------------
+# In-memory Redis stand-in (the commands used by the proxy)
+# ---------------------------------------------------------------------------
+def run_stub_redis(port):
+    """Serve PING, GET, MGET, SET [EX|PX] [NX], EXISTS, DEL/UNLINK, EXPIRE and the lock-release EVAL"""
+    data = {}  # key -> (value, expires_at or None)
+
+    def get(key):
+        item = data.get(key)
+        if item and item[1] is not None and item[1] <= time.monotonic():
+            del data[key]
+            return None
+        return item[0] if item else None
+
+    def bulk(value):
+        return b"$-1\r\n" if value is None else b"$%d\r\n%b\r\n" % (len(value), value)
+
+    def execute(args):
+        command = args[0].upper()
+        if command == b"PING":
+            return b"+PONG\r\n"
+        if command == b"GET":
+            return bulk(get(args[1]))
+        if command == b"MGET":
+            return b"*%d\r\n" % (len(args) - 1) + b"".join(bulk(get(key)) for key in args[1:])
+        if command == b"SET":
+            options = [arg.upper() for arg in args[3:]]
+            expires = None
+            for unit, scale in ((b"EX", 1), (b"PX", 0.001)):
+                if unit in options:
+                    expires = time.monotonic() + int(args[3 + options.index(unit) + 1]) * scale
+            if b"NX" in options and get(args[1]) is not None:
+                return b"$-1\r\n"
+            data[args[1]] = (args[2], expires)
+            return b"+OK\r\n"
+        if command == b"EXISTS":
+            return b":%d\r\n" % sum(get(key) is not None for key in args[1:])
+        if command in (b"DEL", b"UNLINK"):
+            return b":%d\r\n" % sum(data.pop(key, None) is not None for key in args[1:])
+        if command == b"EXPIRE":
+            if get(args[1]) is None:
+                return b":0\r\n"
+            data[args[1]] = (data[args[1]][0], time.monotonic() + int(args[2]))
+            return b":1\r\n"
+        if command == b"EVAL" and b'redis.call("get", KEYS[1]) == ARGV[1]' in args[1]:
+            if get(args[3]) == args[4]:
+                del data[args[3]]
+                return b":1\r\n"
+            return b":0\r\n"
+        if command in (b"CLIENT", b"SELECT"):
+            return b"+OK\r\n"
+        return b"-ERR unknown command '%b'\r\n" % args[0]
+
+    async def serve(reader, writer):
+        parser = hiredis.Reader()
+        while chunk := await reader.read(65536):
+            parser.feed(chunk)
+            replies = []
+            while (args := parser.gets()) is not False:
+                replies.append(execute(args))
+            writer.write(b"".join(replies))
+        writer.close()
+
+    async def main():
+        server = await asyncio.start_server(serve, "127.0.0.1", port)
+        async with server:
+            await server.serve_forever()
+
+    asyncio.run(main())
+
+
+# ---------------------------------------------------------------------------
+# Load generation
+# ---------------------------------------------------------------------------
+async def drive(base_url, scenario, rps, duration, seed):
+    """Send Zipf-distributed requests at `rps` for `duration` seconds (open loop)"""
+    cumulative = zipf_cumulative(scenario["keys"], scenario["zipf"])
+    rnd = random.Random(seed)
+    result = {"latencies": [], "status": Counter(), "cache": Counter(), "bytes": 0, "errors": 0, "dropped": 0}
+    inflight = set()
+    connector = aiohttp.TCPConnector(limit=CLIENT_CONNECTIONS)
+    # Varnish sends Accept-Encoding: gzip and keeps the body compressed
+    async with aiohttp.ClientSession(connector=connector, auto_decompress=False,
+                                     headers={"Accept-Encoding": "gzip"}) as session:
+
+        async def one(url, scheduled):
+            try:
+                async with session.get(base_url + url) as resp:
+                    result["bytes"] += len(await resp.read())
+                    result["status"][resp.status] += 1
+                    result["cache"][resp.headers.get("X-Redis-Cache", "NONE")] += 1
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                result["errors"] += 1
+            result["latencies"].append(loop.time() - scheduled)
+
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        for n in itertools.count():
+            scheduled = start + n / rps
+            if scheduled - start >= duration:
+                break
+            delay = scheduled - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            if len(inflight) >= CLIENT_CONNECTIONS:
+                result["dropped"] += 1  # client saturated: count instead of queueing
+                continue
+            rank = bisect.bisect_left(cumulative, rnd.random() * cumulative[-1])
+            task = asyncio.create_task(one(url_for(rank), scheduled))
+            inflight.add(task)
+            task.add_done_callback(inflight.discard)
+        if inflight:
+            await asyncio.wait(inflight)
+    return result
+
+
+def run_client(args):
+    """Entry point of a client process"""
+    base_url, scenario, rps, duration, seed = args
+    started = time.time()
+    result = asyncio.run(drive(base_url, scenario, rps, duration, seed))
+    result["started"], result["finished"] = started, time.time()
+    result["status"], result["cache"] = dict(result["status"]), dict(result["cache"])
+    return result
+
+
+async def warm(base_url, keys, concurrency=32):
+    """Request every key once so that the run starts from a warm cache"""
+    ranks = iter(range(keys))
+
+    async def worker(session):
+        for rank in ranks:
+            async with session.get(base_url + url_for(rank)) as resp:
+                await resp.read()
+
+    async with aiohttp.ClientSession(auto_decompress=False,
+                                     headers={"Accept-Encoding": "gzip"}) as session:
+        await asyncio.gather(*(worker(session) for _ in range(concurrency)))
+
+
+# ---------------------------------------------------------------------------
+# Process management and measurement
+# ---------------------------------------------------------------------------
+def process_tree(pid):
+    """pid and its descendants (Linux /proc)"""
+    children = {}
+    for stat in Path("/proc").glob("[0-9]*/stat"):
+        try:
+            fields = stat.read_text().rsplit(")", 1)[1].split()
+        except OSError:
+            continue
+        children.setdefault(int(fields[1]), []).append(int(stat.parent.name))
+    tree, pending = [], [pid]
+    while pending:
+        current = pending.pop()
+        tree.append(current)
+        pending += children.get(current, [])
+    return tree
+
+
+def tree_usage(pid):
+    """(RSS bytes, CPU seconds) summed over a process tree"""
+    rss = cpu = 0
+    ticks = os.sysconf("SC_CLK_TCK")
+    for member in process_tree(pid):
+        try:
+            fields = Path(f"/proc/{member}/stat").read_text().rsplit(")", 1)[1].split()
+        except OSError:
+            continue
+        cpu += (int(fields[11]) + int(fields[12])) / ticks
+        rss += int(fields[21]) * os.sysconf("SC_PAGE_SIZE")
+    return rss, cpu
+
+
+class RssSampler(threading.Thread):
+    """Record the peak RSS of a process tree while running"""
+
+    def __init__(self, pid):
+        super().__init__(daemon=True)
+        self.pid = pid
+        self.peak = 0
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(RSS_SAMPLE_INTERVAL):
+            self.peak = max(self.peak, tree_usage(self.pid)[0])
+
+
+def wait_http(url, timeout=30):
+    """Wait until url answers 200"""
+    deadline = time.monotonic() + timeout
+
+    async def probe():
+        async with aiohttp.ClientSession() as session:
+            while time.monotonic() < deadline:
+                try:
+                    async with session.get(url) as resp:
+                        if resp.status == 200:
+                            return True
+                except aiohttp.ClientError:
+                    pass
+                await asyncio.sleep(0.1)
+        return False
+
+    if not asyncio.run(probe()):
+        raise RuntimeError(f"{url} did not become ready within {timeout}s")
+
+
+def fetch_json(url):
+    async def get():
+        async with aiohttp.ClientSession() as session:
+            async with session.get(url) as resp:
+                return await resp.json()
+    return asyncio.run(get())
+
+
+def start(command, log, env=None):
+    return subprocess.Popen(command, stdout=log, stderr=subprocess.STDOUT, env=env, start_new_session=True)
+
+
+def stop(proc):
+    if proc and proc.poll() is None:
+        proc.send_signal(signal.SIGTERM)
+        try:
+            proc.wait(timeout=15)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+            proc.wait()
+
+
+def percentile(quantiles, p):
+    return quantiles[p - 1] * 1000 if quantiles else None
+
+
+def run_scenario(name, scenario, args, workdir, proxy_file):
+    """Start Redis, the stub backend and the proxy, drive the load and return the measurements"""
+    backend_port, redis_port, proxy_port = free_port(), free_port(), free_port()
+    log = open(workdir / f"{name}.log", "w")
+    processes = []
+    try:
+        if args.redis == "server":
+            processes.append(start([shutil.which("redis-server"), "--port", str(redis_port), "--save", "",
+                                    "--appendonly", "no", "--maxmemory", args.redis_maxmemory,
+                                    "--maxmemory-policy", "allkeys-lfu"], log))
+        else:
+            processes.append(start([sys.executable, __file__, "--stub-redis", str(redis_port)], log))
+        processes.append(start([sys.executable, __file__, "--stub-backend", str(backend_port),
+                                "--scenario", name], log))
+        time.sleep(0.5)
+        env = dict(os.environ, REDIS_HOST="127.0.0.1", REDIS_PORT=str(redis_port),
+                   BACKEND_HOST="127.0.0.1", BACKEND_PORT=str(backend_port),
+                   LISTEN_PORT=str(proxy_port), WORKERS=str(args.workers), LOG_LEVEL="WARNING")
+        env.pop("SNAPSHOT_PATH", None)
+        proxy = start([sys.executable, str(proxy_file)], log, env)
+        processes.append(proxy)
+        base_url = f"http://127.0.0.1:{proxy_port}"
+        wait_http(base_url + "/healthz")
+
+        if scenario["warm"]:
+            started = time.perf_counter()
+            asyncio.run(warm(base_url, scenario["keys"]))
+            print(f"  warmed {scenario['keys']} keys in {time.perf_counter() - started:.1f}s")
+
+        rps = args.rps * scenario["rps_factor"]
+        stats_before = fetch_json(base_url + "/cache-stats")
+        cpu_before = tree_usage(proxy.pid)[1]
+        sampler = RssSampler(proxy.pid)
+        sampler.start()
+        jobs = [(base_url, scenario, rps / args.clients, args.duration, n) for n in range(args.clients)]
+        with ProcessPoolExecutor(args.clients, mp_context=get_context("spawn")) as pool:
+            client_results = list(pool.map(run_client, jobs))
+        sampler.stopped.set()
+        sampler.join()
+        cpu = tree_usage(proxy.pid)[1] - cpu_before
+        stats_after = fetch_json(base_url + "/cache-stats")
+    finally:
+        for proc in reversed(processes):
+            stop(proc)
+        log.close()
+
+    elapsed = max(r["finished"] for r in client_results) - min(r["started"] for r in client_results)
+    latencies = sorted(itertools.chain.from_iterable(r["latencies"] for r in client_results))
+    status, cache = Counter(), Counter()
+    for r in client_results:
+        status.update(r["status"])
+        cache.update(r["cache"])
+    completed = sum(status.values())
+    quantiles = statistics.quantiles(latencies, n=100) if len(latencies) > 1 else []
+    cached = cache["HIT"] + cache["STALE"]
+    return {
+        "description": scenario["description"],
+        "target_rps": rps,
+        "requests": completed,
+        "errors": sum(r["errors"] for r in client_results),
+        "dropped": sum(r["dropped"] for r in client_results),
+        "throughput_rps": completed / elapsed,
+        "bytes_per_second": sum(r["bytes"] for r in client_results) / elapsed,
+        "latency_ms": {
+            "p50": percentile(quantiles, 50),
+            "p95": percentile(quantiles, 95),
+            "p99": percentile(quantiles, 99),
+            "max": latencies[-1] * 1000 if latencies else None,
+        },
+        "hit_ratio": cached / completed if completed else None,
+        "cache": dict(cache),
+        "status": {str(code): count for code, count in sorted(status.items())},
+        "backend_requests": stats_after.get("backend_requests", 0) - stats_before.get("backend_requests", 0),
+        "proxy_cpu_seconds": cpu,
+        "proxy_peak_rss_mb": sampler.peak / 1024 / 1024,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Load-test the Redis API cache proxy')
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS),
+                        help=f'Comma-separated scenarios (default: {",".join(SCENARIOS)})')
+    parser.add_argument('--rps', type=float, default=1000,
+                        help='Target requests per second, scaled down for heavier scenarios (default: 1000)')
+    parser.add_argument('--duration', type=float, default=20, help='Seconds of load per scenario (default: 20)')
+    parser.add_argument('--clients', type=int, default=2, help='Load generator processes (default: 2)')
+    parser.add_argument('--workers', type=int, default=1, help='Proxy worker processes (WORKERS, default: 1)')
+    parser.add_argument('--redis', choices=['auto', 'server', 'memory'], default='auto',
+                        help='Local redis-server, in-memory stand-in, or server when installed (default: auto)')
+    parser.add_argument('--redis-maxmemory', default='2gb', help='maxmemory of the local redis-server')
+    parser.add_argument('--proxy-source', default=str(PROXY_DOC),
+                        help='proxy.py, or the documentation embedding it (default: docs/oc-api-redis-cache.md)')
+    parser.add_argument('--output', default='bench-api-cache.json', help='JSON results file')
+    parser.add_argument('--stub-backend', type=int, metavar='PORT', help=argparse.SUPPRESS)
+    parser.add_argument('--stub-redis', type=int, metavar='PORT', help=argparse.SUPPRESS)
+    parser.add_argument('--scenario', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.stub_backend:
+        return run_stub_backend(args.stub_backend, SCENARIOS[args.scenario])
+    if args.stub_redis:
+        return run_stub_redis(args.stub_redis)
+
+    names = [name.strip() for name in args.scenarios.split(",") if name.strip()]
+    unknown = [name for name in names if name not in SCENARIOS]
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(unknown)}")
+    if args.redis == "auto":
+        args.redis = "server" if shutil.which("redis-server") else "memory"
+    elif args.redis == "server" and not shutil.which("redis-server"):
+        parser.error("redis-server not found in PATH")
+
+    workdir = Path(tempfile.mkdtemp(prefix="api-cache-bench-"))
+    output = Path(args.output).resolve()
+    results = {}
+    try:
+        proxy_file = workdir / "proxy.py"
+        extract_proxy(args.proxy_source, proxy_file)
+        print(f"Proxy from {args.proxy_source}, Redis: {args.redis}, logs in {workdir}")
+        for name in names:
+            print(f"\n{name}: {SCENARIOS[name]['description']}")
+            result = results[name] = run_scenario(name, SCENARIOS[name], args, workdir, proxy_file)
+            latency = result["latency_ms"]
+            print(f"  {result['throughput_rps']:10.1f} req/s (target {result['target_rps']:.0f})"
+                  f"  p50 {latency['p50']:8.2f} ms  p95 {latency['p95']:8.2f} ms  p99 {latency['p99']:8.2f} ms")
+            print(f"  hit ratio {result['hit_ratio']:.3f}  backend requests {result['backend_requests']}"
+                  f"  errors {result['errors']}  dropped {result['dropped']}"
+                  f"  proxy CPU {result['proxy_cpu_seconds']:.1f}s  peak RSS {result['proxy_peak_rss_mb']:.0f} MB")
+    finally:
+        if not any(path.suffix == ".log" and path.stat().st_size for path in workdir.iterdir()):
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {
+        "benchmark": "api_cache",
+        "version": repo_version(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "parameters": {
+            "scenarios": names,
+            "rps": args.rps,
+            "duration": args.duration,
+            "clients": args.clients,
+            "workers": args.workers,
+            "redis": args.redis,
+            "proxy_source": args.proxy_source,
+        },
+        "results": results,
+    }
+    output.write_text(json.dumps(report, indent=2))
+    print(f"\nResults written to {output}")
+
+
+if __name__ == "__main__":
+    main()
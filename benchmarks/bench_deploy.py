@@ -0,0 +1,301 @@
+#!/usr/bin/python3
+"""
+Benchmark deploy.py render/diff/apply throughput on a synthetic fleet.
+
+Generates a fleet of multi-document manifests and a large .env in a temporary
+directory, then times load_environment(), process_yaml(), show_changes(),
+create_production_files(), the parallel apply path (against a fake kubectl)
+and create_production_files_and_push() (against a local bare git remote).
+Results are written as JSON so that runs of different versions can be compared.
+
+Usage:
+    python3 benchmarks/bench_deploy.py --manifests 1000 --variables 5000 --output bench.json
+"""
+import os
+import io
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import statistics
+import subprocess
+from pathlib import Path
+from contextlib import redirect_stdout
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(REPO_ROOT))
+
+import deploy  # noqa: E402
+
+MANIFEST_TEMPLATE = """# dependsOn: {depends_on}
+apiVersion: apps/v1
+kind: Deployment
+metadata:
+  name: svc-{index}
+  namespace: default
+  labels:
+    app: svc-{index}
+spec:
+  replicas: 2
+  selector:
+    matchLabels:
+      app: svc-{index}
+  template:
+    metadata:
+      labels:
+        app: svc-{index}
+    spec:
+      containers:
+        - name: svc-{index}
+          image: opencitations/svc-{index}:${{SVC_{index}_VERSION}}
+          env:
+{env_entries}
+          command:
+            - /bin/sh
+            - -c
+            - |
+              STAMP=$(date +%s)
+              echo "started ${{STAMP}}"
+---
+apiVersion: v1
+kind: Service
+metadata:
+  name: svc-{index}-service
+  namespace: default
+spec:
+  selector:
+    app: svc-{index}
+  ports:
+    - port: 80
+      targetPort: 8080
+---
+apiVersion: traefik.io/v1alpha1
+kind: IngressRoute
+metadata:
+  name: svc-{index}
+  namespace: default
+spec:
+  entryPoints:
+    - websecure
+  routes:
+    - match: Host(`${{SVC_{index}_HOST}}`)
+      kind: Rule
+      services:
+        - name: svc-{index}-service
+          port: 80
+"""
+
+FAKE_KUBECTL = """#!/bin/sh
+cat > /dev/null
+echo "applied"
+"""
+
+
+def generate_env(variables, manifests, version="1.0.0"):
+    """Return .env content with plain, computed and chained computed variables"""
+    lines = ["# Synthetic benchmark environment"]
+    for i in range(manifests):
+        lines.append(f"SVC_{i}_VERSION={version}")
+        lines.append(f"SVC_{i}_HOST=svc-{i}.example.org")
+    shared = max(variables - 2 * manifests, 10)
+    for i in range(shared):
+        if i % 10 == 9:
+            # Computed variable referencing a plain one and the previous computed one
+            previous = f"VAR_{i - 10}" if i >= 10 else "VAR_0"
+            lines.append(f"VAR_{i} = 'http://' + VAR_{i - 1} + ':' + {previous}  # computed")
+        else:
+            lines.append(f"VAR_{i}=value-{i}")
+    return "\n".join(lines) + "\n", shared
+
+
+def generate_fleet(root, manifests, variables, vars_per_manifest):
+    """Create manifests/ and .env under root; return the number of shared variables"""
+    env_content, shared = generate_env(variables, manifests)
+    (root / ".env").write_text(env_content)
+    manifests_dir = root / "manifests"
+    manifests_dir.mkdir()
+    width = len(str(manifests))
+    for i in range(manifests):
+        env_entries = "\n".join(
+            f"            - name: VAR_{(i * 7 + j) % shared}\n"
+            f"              value: \"${{VAR_{(i * 7 + j) % shared}}}\""
+            for j in range(vars_per_manifest)
+        )
+        # A few root manifests, everything else waits for its group leader
+        depends_on = "none" if i % 100 == 0 else str((i // 100) * 100).zfill(width)
+        (manifests_dir / f"{str(i).zfill(width)}-svc.yaml").write_text(
+            MANIFEST_TEMPLATE.format(index=i, depends_on=depends_on, env_entries=env_entries)
+        )
+    return shared
+
+
+def bump_versions(root, manifests, fraction):
+    """Change the image version of a fraction of the manifests in .env"""
+    env_file = root / ".env"
+    step = max(int(1 / fraction), 1)
+    lines = env_file.read_text().splitlines()
+    for n, line in enumerate(lines):
+        for i in range(0, manifests, step):
+            if line.startswith(f"SVC_{i}_VERSION="):
+                lines[n] = f"SVC_{i}_VERSION=1.0.1"
+    env_file.write_text("\n".join(lines) + "\n")
+
+
+def measure(results, name, func, repeat, setup=None, items=None, nbytes=None):
+    """Time func() `repeat` times with its output silenced and store the statistics"""
+    runs = []
+    for _ in range(repeat):
+        if setup:
+            setup()
+        with redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            func()
+            runs.append(time.perf_counter() - start)
+    median = statistics.median(runs)
+    results[name] = {"runs": runs, "median": median, "min": min(runs)}
+    if items:
+        results[name]["items_per_second"] = items / median if median else None
+    if nbytes:
+        results[name]["bytes_per_second"] = nbytes / median if median else None
+    print(f"  {name:<28} median {median * 1000:10.2f} ms  min {min(runs) * 1000:10.2f} ms")
+
+
+def repo_version():
+    """Describe the deploy.py version being measured"""
+    try:
+        return subprocess.run(["git", "describe", "--always", "--dirty"], cwd=REPO_ROOT,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark deploy.py on a synthetic fleet')
+    parser.add_argument('--manifests', type=int, default=1000, help='Number of manifest files (default: 1000)')
+    parser.add_argument('--variables', type=int, default=5000, help='Number of .env variables (default: 5000)')
+    parser.add_argument('--vars-per-manifest', type=int, default=20,
+                        help='Shared variables referenced by each manifest (default: 20)')
+    parser.add_argument('--repeat', type=int, default=3, help='Runs per measurement (default: 3)')
+    parser.add_argument('--jobs', type=int, default=deploy.DEFAULT_JOBS, help='Parallel applies')
+    parser.add_argument('--skip-apply', action='store_true', help='Do not benchmark the apply path')
+    parser.add_argument('--skip-push', action='store_true', help='Do not benchmark the fleet push path')
+    parser.add_argument('--output', default='bench-deploy.json', help='JSON results file')
+    args = parser.parse_args()
+
+    workdir = Path(tempfile.mkdtemp(prefix="deploy-bench-"))
+    cwd = os.getcwd()
+    output = Path(args.output).resolve()
+    results = {}
+    try:
+        print(f"Generating {args.manifests} manifests and {args.variables} variables in {workdir}...")
+        generate_fleet(workdir, args.manifests, args.variables, args.vars_per_manifest)
+        os.chdir(workdir)
+        manifest_files = sorted(Path("manifests").glob("*.yaml"))
+        template_bytes = sum(f.stat().st_size for f in manifest_files)
+
+        print("\nRunning benchmarks:")
+
+        def reset_env_cache():
+            deploy._environment_cache = None
+
+        measure(results, "load_environment_cold", deploy.load_environment, args.repeat,
+                setup=reset_env_cache)
+        measure(results, "load_environment_cached", deploy.load_environment, args.repeat)
+        env_vars = deploy.load_environment()
+
+        def render_all():
+            for manifest in manifest_files:
+                deploy.process_yaml(manifest, env_vars)
+
+        measure(results, "process_yaml_cold", render_all, args.repeat,
+                setup=deploy._template_cache.clear,
+                items=len(manifest_files), nbytes=template_bytes)
+        measure(results, "process_yaml_cached", render_all, args.repeat,
+                items=len(manifest_files), nbytes=template_bytes)
+
+        rendered = {m.name: deploy.process_yaml(m, env_vars) for m in manifest_files}
+        original = dict(rendered)
+        for i, name in enumerate(sorted(original)):
+            if i % 10 == 0:
+                original[name] += "# modified\n"
+        measure(results, "show_changes", lambda: deploy.show_changes(original, rendered),
+                args.repeat, items=len(rendered))
+
+        measure(results, "create_production_files",
+                lambda: deploy.create_production_files("production-ready"),
+                args.repeat, items=len(manifest_files), nbytes=template_bytes)
+
+        if not args.skip_apply:
+            bin_dir = workdir / "bin"
+            bin_dir.mkdir()
+            kubectl = bin_dir / "kubectl"
+            kubectl.write_text(FAKE_KUBECTL)
+            kubectl.chmod(0o755)
+            os.environ["PATH"] = f"{bin_dir}{os.pathsep}{os.environ['PATH']}"
+            deploy.set_cluster_backend("kubectl")
+
+            def clear_state():
+                shutil.rmtree(deploy.DEPLOY_STATE_DIR, ignore_errors=True)
+
+            measure(results, "apply_parallel",
+                    lambda: deploy.apply_manifests(manifest_files, env_vars, args.jobs),
+                    args.repeat, setup=clear_state, items=len(manifest_files))
+            measure(results, "apply_batch",
+                    lambda: deploy.apply_manifest_batches(manifest_files, env_vars),
+                    args.repeat, setup=clear_state, items=len(manifest_files))
+            measure(results, "apply_changed_only_noop",
+                    lambda: deploy.apply_manifests(manifest_files, env_vars, args.jobs, changed_only=True),
+                    args.repeat, items=len(manifest_files))
+
+        if not args.skip_push:
+            remote = workdir / "fleet.git"
+            subprocess.run(["git", "init", "-q", "--bare", "-b", "main", str(remote)], check=True)
+            seed = workdir / "seed"
+            subprocess.run(["git", "clone", "-q", str(remote), str(seed)], check=True,
+                           capture_output=True)
+            (seed / "README.md").write_text("fleet\n")
+            for cmd in (["git", "add", "."], ["git", "commit", "-q", "-m", "seed"],
+                        ["git", "push", "-q", "origin", "main"]):
+                subprocess.run(cmd, cwd=seed, check=True)
+
+            with open(".env", "a") as f:
+                f.write(f"PRIVATE_REPO_URL=file://{remote}\nGIT_USERNAME=bench\nGIT_TOKEN=bench\n")
+            for var in ("GIT_AUTHOR_NAME", "GIT_COMMITTER_NAME"):
+                os.environ.setdefault(var, "bench")
+            for var in ("GIT_AUTHOR_EMAIL", "GIT_COMMITTER_EMAIL"):
+                os.environ.setdefault(var, "bench@example.org")
+            deploy.confirm = lambda prompt="": True
+            push = lambda: deploy.create_production_files_and_push("production-ready")
+
+            measure(results, "fleet_push_initial", push, 1, items=len(manifest_files))
+            measure(results, "fleet_push_noop", push, args.repeat, items=len(manifest_files))
+            bump_versions(workdir, args.manifests, 0.1)
+            measure(results, "fleet_push_10pct_changed", push, 1, items=len(manifest_files))
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {
+        "benchmark": "deploy",
+        "version": repo_version(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "parameters": {
+            "manifests": args.manifests,
+            "variables": args.variables,
+            "vars_per_manifest": args.vars_per_manifest,
+            "repeat": args.repeat,
+            "jobs": args.jobs,
+        },
+        "results": results,
+    }
+    output.write_text(json.dumps(report, indent=2))
+    print(f"\nResults written to {output}")
+
+
+if __name__ == "__main__":
+    main()
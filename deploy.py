@@ -1,15 +1,231 @@
 #!/usr/bin/python3
 import os
+import re
+import json
+import base64
+import atexit
+import hashlib
+import tempfile
+import threading
 import sys
 import subprocess
 import argparse
 from pathlib import Path
-from dotenv import load_dotenv
 import shutil
 import time
 import datetime  
-import yaml
-import git
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait as wait_for_futures
+
+# Default number of manifests applied concurrently by deploy_all_manifests()
+DEFAULT_JOBS = 4
+
+# Optional '# dependsOn: 01, 02' line declaring the manifests (by numeric prefix)
+# that must be applied before this one. '# dependsOn: none' marks a root manifest.
+# Only read from the leading comment header of the file, see read_depends_on().
+DEPENDS_ON_PATTERN = re.compile(r'^#\s*dependsOn:\s*(.*?)\s*$')
+
+# Backend used for cluster operations, see set_cluster_backend()
+_cluster_backend = None
+
+# Field manager of client-side 'kubectl apply'. Its fields are handed over to
+# server-side apply before the first in-process apply of an object, as
+# 'kubectl apply --server-side' does, so they do not conflict.
+CSA_FIELD_MANAGER = "kubectl-client-side-apply"
+
+# Workload kinds whose rollout can be waited for after an apply
+WORKLOAD_KINDS = ("Deployment", "StatefulSet", "DaemonSet", "Pod")
+
+# MetalLB workloads created by metallb-native.yaml
+METALLB_WORKLOADS = [
+    ("apps/v1", "Deployment", "controller", "metallb-system"),
+    ("apps/v1", "DaemonSet", "speaker", "metallb-system"),
+]
+
+# Per-workload readiness timeout and backoff between re-checks (seconds)
+DEFAULT_READY_TIMEOUT = 600
+READY_BACKOFF_INITIAL = 0.5
+READY_BACKOFF_MAX = 10
+
+# Local store of the last successful apply of each manifest (used by --changed-only)
+DEPLOY_STATE_DIR = Path('.deploy-state')
+
+# Cluster the deploy state refers to: (kube context, API server, namespace), see cluster_identity()
+_cluster_identity = None
+
+# Cached shallow working copy of the fleet repository
+FLEET_REPO_DIR = DEPLOY_STATE_DIR / 'fleet-repo'
+
+# Resolved .env for this process: ((path, mtime_ns, size), env_vars)
+_environment_cache = None
+
+# Variable names usable in computed .env expressions
+ENV_NAME_PATTERN = re.compile(r'^[A-Za-z_][A-Za-z0-9_]*$')
+
+# ${KEY} placeholders substituted from .env
+PLACEHOLDER_PATTERN = re.compile(r'\$\{([A-Za-z0-9_]+)\}')
+
+# Shell variables assigned in the script blocks of a template: 'NAME=' starting
+# a line or a command (after ;, &&, ||, a pipe, a subshell, export/local/readonly)
+LOCAL_DEFINITION_PATTERN = re.compile(
+    r'(?:^|[;&|(]|\b(?:export|local|readonly|then|do|else))[ \t]*([A-Za-z_]\w*)=',
+    re.MULTILINE)
+
+# Compiled templates by resolved path: {path: ((mtime_ns, size), compiled)}
+_template_cache = {}
+
+# Spans of this run (see trace_span()): the root span and a per-thread stack of open spans
+_trace_root = None
+_trace_local = threading.local()
+_trace_lock = threading.Lock()
+
+class TraceSpan:
+    """A timed phase of a run, recording wall time, subprocess time, bytes rendered and exit status"""
+
+    def __init__(self, name, parent=None, subprocess=False):
+        self.name = name
+        self.parent = parent
+        self.subprocess = subprocess
+        self.thread = threading.current_thread().name
+        self.start = time.monotonic()
+        self.end = None
+        self.bytes_rendered = 0
+        self.status = "ok"
+        self.children = []
+
+    @property
+    def wall(self):
+        return (self.end or time.monotonic()) - self.start
+
+    def subprocess_seconds(self):
+        """Time spent in subprocesses by this span and its descendants"""
+        if self.subprocess:
+            return self.wall
+        return sum(child.subprocess_seconds() for child in self.children)
+
+    def total_bytes_rendered(self):
+        """Bytes rendered by this span and its descendants"""
+        return self.bytes_rendered + sum(child.total_bytes_rendered() for child in self.children)
+
+def current_span():
+    """Return the innermost open span of the calling thread (or the open root span)"""
+    stack = getattr(_trace_local, "stack", None)
+    if stack:
+        return stack[-1]
+    return _trace_root if _trace_root and _trace_root.end is None else None
+
+@contextmanager
+def trace_span(name, parent=None, subprocess=False):
+    """
+    Time a phase of the run as a child of `parent` (by default the current span
+    of the calling thread; worker threads pass it explicitly). With subprocess,
+    the whole span is accounted as subprocess time. The span status is the exit
+    code or exception that ended it, unless set by the caller.
+    """
+    global _trace_root
+    if not hasattr(_trace_local, "stack"):
+        _trace_local.stack = []
+    span = TraceSpan(name, parent or current_span(), subprocess)
+    if span.parent is None:
+        _trace_root = span
+    else:
+        with _trace_lock:
+            span.parent.children.append(span)
+    _trace_local.stack.append(span)
+    try:
+        yield span
+    except SystemExit as e:
+        span.status = f"exit {e.code or 0}"
+        raise
+    except BaseException as e:
+        span.status = f"error: {type(e).__name__}"
+        raise
+    finally:
+        _trace_local.stack.pop()
+        span.end = time.monotonic()
+
+def critical_path(span):
+    """
+    Return the leaf spans that determined the wall time of `span`: walking back
+    from its end, the child that finished last, then the child that finished
+    last before that one started, and so on, expanded recursively.
+    """
+    chain, cursor = [], span.end
+    for child in sorted((c for c in span.children if c.end), key=lambda c: c.end, reverse=True):
+        if child.end <= cursor:
+            chain.append(child)
+            cursor = child.start
+    if not chain:
+        return [span]
+    return [leaf for child in reversed(chain) for leaf in critical_path(child)]
+
+def span_label(span):
+    """Name a span by its ancestors below the root, e.g. 'deploy 06-x.yaml > kubectl apply'"""
+    names = []
+    while span is not None and span.parent is not None:
+        names.append(span.name)
+        span = span.parent
+    return " > ".join(reversed(names)) or (span.name if span else "")
+
+def _walk_spans(span, depth=0):
+    yield span, depth
+    for child in sorted(span.children, key=lambda c: c.start):
+        yield from _walk_spans(child, depth + 1)
+
+def print_trace(root):
+    """Print the span tree of a run and its critical path"""
+    print("\nTrace:")
+    print("======")
+    print(f"  {'wall':>8}  {'subproc':>8}  {'rendered':>9}  status")
+    for span, depth in _walk_spans(root):
+        print(f"  {span.wall:7.2f}s  {span.subprocess_seconds():7.2f}s  {span.total_bytes_rendered():8d}B"
+              f"  {span.status:<8} {'  ' * depth}{span.name}")
+
+    path = critical_path(root)
+    total = root.wall
+    print(f"\nCritical path ({len(path)} steps, {sum(s.wall for s in path):.2f}s of {total:.2f}s):")
+    for span in sorted(path, key=lambda s: s.wall, reverse=True)[:10]:
+        share = span.wall / total * 100 if total else 0
+        print(f"  {span.wall:7.2f}s {share:5.1f}%  {span_label(span)}")
+    if len(path) > 10:
+        print(f"  ... and {len(path) - 10} shorter steps")
+
+def write_trace_report(root, report_path):
+    """Write the spans of a run and its critical path as JSON"""
+    ids = {}
+    spans = []
+    for span, depth in _walk_spans(root):
+        ids[id(span)] = len(spans)
+        spans.append({
+            "id": len(spans),
+            "parent": ids.get(id(span.parent)),
+            "name": span.name,
+            "thread": span.thread,
+            "start": round(span.start - root.start, 6),
+            "wall_seconds": round(span.wall, 6),
+            "subprocess_seconds": round(span.subprocess_seconds(), 6),
+            "bytes_rendered": span.total_bytes_rendered(),
+            "status": span.status,
+        })
+    total = root.wall
+    report = {
+        "command": sys.argv,
+        "started_at": (datetime.datetime.now() - datetime.timedelta(seconds=total)).isoformat(timespec='seconds'),
+        "wall_seconds": round(total, 6),
+        "status": root.status,
+        "spans": spans,
+        "critical_path": [
+            {
+                "id": ids[id(span)],
+                "name": span_label(span),
+                "wall_seconds": round(span.wall, 6),
+                "share": round(span.wall / total, 4) if total else 0,
+            }
+            for span in critical_path(root)
+        ],
+    }
+    Path(report_path).write_text(json.dumps(report, indent=2))
+    print(f"\nTrace report written to {report_path}")
 
 def check_helm_installation():
     """Check if Helm is installed, install if not"""
@@ -23,94 +239,700 @@ def check_helm_installation():
     else:
         print("Helm is already installed")
 
-def load_environment():
-    """Load environment variables from .env file and process computed variables"""
-    if not os.path.exists('.env'):
-        print("Error: .env file not found")
+def _strip_inline_comment(value):
+    """
+    Remove a trailing ' # comment' that is outside quotes. A '#' only starts a
+    comment after whitespace, so values such as '#abc' or 'a#b' are kept.
+    """
+    quote = None
+    for i, char in enumerate(value):
+        if quote:
+            if char == quote:
+                quote = None
+        elif char in "'\"":
+            quote = char
+        elif char == '#' and i > 0 and value[i - 1].isspace():
+            return value[:i].rstrip()
+    return value
+
+def _split_expression(value):
+    """
+    Split a computed value like 'http://' + HOST + ':80' on the '+' signs that
+    are outside quotes. Returns None if the value is not an expression, i.e.
+    it has no such '+' or a part is neither a quoted literal nor a variable name.
+    """
+    parts, current, quote = [], [], None
+    for char in value:
+        if quote:
+            if char == quote:
+                quote = None
+        elif char in "'\"":
+            quote = char
+        elif char == '+':
+            parts.append(''.join(current).strip())
+            current = []
+            continue
+        current.append(char)
+    parts.append(''.join(current).strip())
+
+    if len(parts) < 2:
+        return None
+    for part in parts:
+        quoted = len(part) > 1 and part[0] == part[-1] and part[0] in "'\""
+        if not quoted and not ENV_NAME_PATTERN.match(part):
+            return None
+    return parts
+
+def load_environment(env_file='.env'):
+    """
+    Load environment variables from .env file and process computed variables.
+    Computed variables ('a' + NAME + 'b') may reference other computed variables:
+    they are resolved in dependency order and circular references are an error.
+    The result is cached for the process until the file changes.
+    """
+    global _environment_cache
+    if not os.path.exists(env_file):
+        print(f"Error: {env_file} file not found")
         print("Please copy .env.example to .env and set your values")
         sys.exit(1)
+
+    stat = os.stat(env_file)
+    signature = (os.path.abspath(env_file), stat.st_mtime_ns, stat.st_size)
+    if _environment_cache and _environment_cache[0] == signature:
+        return dict(_environment_cache[1])
     
     env_vars = {}
     computed_vars = {}
     
     # First pass to collect variable definitions
-    with open('.env', 'r') as file:
+    with open(env_file, 'r') as file:
         for line in file:
             line = line.strip()
             if line and not line.startswith('#'):
                 key, value = line.split('=', 1)
                 key = key.strip()
-                value = value.strip()
+                value = _strip_inline_comment(value.strip())
                 
-                # Check if value contains an expression with '+'
-                if '+' in value:
-                    computed_vars[key] = value
+                # Check if value is an expression concatenating parts with '+'
+                parts = _split_expression(value)
+                if parts:
+                    computed_vars[key] = parts
+                    env_vars.pop(key, None)
                 else:
                     env_vars[key] = value
+                    computed_vars.pop(key, None)
     
-    # Now process the computed variables
-    for key, expression in computed_vars.items():
-        # Split expression into its component parts
-        parts = [p.strip() for p in expression.split('+')]
-        
-        # Process each part
+    # Resolve computed variables depth-first, so that dependencies come first
+    resolving = []
+
+    def resolve(key):
+        if key in env_vars:
+            return env_vars[key]
+        if key in resolving:
+            cycle = resolving[resolving.index(key):] + [key]
+            print(f"Error: Circular reference between computed variables: {' -> '.join(cycle)}")
+            sys.exit(1)
+        resolving.append(key)
+
         processed_parts = []
-        for part in parts:
+        for part in computed_vars[key]:
             # Check if part is a literal string (in quotes)
-            if (part.startswith("'") and part.endswith("'")) or \
-               (part.startswith('"') and part.endswith('"')):
-                processed_parts.append(part.strip("'\""))
+            if part[0] in "'\"":
+                processed_parts.append(part[1:-1])
             # Check if part references another variable
+            elif part in env_vars or part in computed_vars:
+                processed_parts.append(resolve(part))
             else:
-                var_name = part.strip()
-                if var_name in env_vars:
-                    processed_parts.append(env_vars[var_name])
-                else:
-                    print(f"Warning: Variable {var_name} referenced in {key} not found")
-                    processed_parts.append("")
-        
+                print(f"Warning: Variable {part} referenced in {key} not found")
+                processed_parts.append("")
+
+        resolving.pop()
         # Combine all parts into final value
         env_vars[key] = ''.join(processed_parts)
+        return env_vars[key]
+
+    for key in computed_vars:
+        resolve(key)
     
-    return env_vars
+    _environment_cache = (signature, env_vars)
+    return dict(env_vars)
+
+def compile_template(file_path):
+    """
+    Compile a template into literal segments and ${KEY} slots.
+
+    Returns (literals, names, local_names): `literals` has one more item than
+    `names`, and `local_names` are the slot names assigned inside the file itself
+    (e.g. shell variables of a CronJob script), which are not expected in .env.
+    Compiled templates are cached by path and modification time.
+    """
+    path = Path(file_path)
+    stat = path.stat()
+    cache_key = str(path.resolve())
+    signature = (stat.st_mtime_ns, stat.st_size)
+    cached = _template_cache.get(cache_key)
+    if cached and cached[0] == signature:
+        return cached[1]
+
+    content = path.read_text()
+    parts = PLACEHOLDER_PATTERN.split(content)
+    literals, names = parts[0::2], parts[1::2]
+    defined = set(LOCAL_DEFINITION_PATTERN.findall(content))
+    local_names = {
+        name for name in set(names)
+        if name.isdigit() or name in defined
+    }
+    compiled = (literals, names, local_names)
+    _template_cache[cache_key] = (signature, compiled)
+    return compiled
+
+def render_template(file_path, env_vars):
+    """
+    Render a template in a single pass over its compiled slots.
+
+    Returns (content, used, unresolved): the rendered text, the set of .env
+    variables substituted and the set of ${...} placeholders that have no value
+    in .env and are not defined in the file itself. Unresolved placeholders are
+    left untouched in the output.
+    """
+    literals, names, local_names = compile_template(file_path)
+    out = [literals[0]]
+    used, unresolved = set(), set()
+    for name, literal in zip(names, literals[1:]):
+        value = env_vars.get(name)
+        if value is None:
+            out.append(f"${{{name}}}")
+            if name not in local_names:
+                unresolved.add(name)
+        else:
+            # Strip quotes only at the start and end of the value
+            if len(value) > 1 and value[0] == value[-1] and value[0] in "\"'":
+                value = value[1:-1]
+            out.append(value)
+            used.add(name)
+        out.append(literal)
+    content = ''.join(out)
+    span = current_span()
+    if span:
+        span.bytes_rendered += len(content)
+    return content, used, unresolved
 
 def process_yaml(file_path, env_vars):
     """Replace placeholders in YAML files with environment variables"""
-    with open(file_path, 'r') as f:
-        content = f.read()
-        
-    for key, value in env_vars.items():
-        # Rimuovi apici solo all'inizio e alla fine della stringa
-        if value.startswith('"') and value.endswith('"'):
-            value = value[1:-1]
-        elif value.startswith("'") and value.endswith("'"):
-            value = value[1:-1]
-        content = content.replace(f"${{{key}}}", value)
+    content, _, _ = render_template(file_path, env_vars)
     return content
 
-def execute_command(command, env=None, quiet=False):
-    """Execute a shell command and capture its output"""
-    try:
-        result = subprocess.run(command, 
-                              shell=True, 
-                              check=True, 
-                              capture_output=True, 
-                              text=True,
-                              env=env)  # Added env parameter
-        if result.stdout and not quiet:
-            print(result.stdout)
-    except subprocess.CalledProcessError as e:
-        if not quiet:
-            print(f"Error executing command: {command}")
-            print(e.stderr)
-        return False
+def execute_command(command, env=None, quiet=False, input=None):
+    """Execute a shell command and capture its output, optionally feeding `input` to its stdin"""
+    with trace_span(f"$ {command}", subprocess=True) as span:
+        try:
+            result = subprocess.run(command, 
+                                  shell=True, 
+                                  check=True, 
+                                  capture_output=True, 
+                                  text=True,
+                                  input=input,
+                                  env=env)  # Added env parameter
+            if result.stdout and not quiet:
+                print(result.stdout)
+        except subprocess.CalledProcessError as e:
+            span.status = f"exit {e.returncode}"
+            if not quiet:
+                print(f"Error executing command: {command}")
+                print(e.stderr)
+            return False
     return True
 
 def confirm(prompt="Are you sure? [y/N]"):
     """Ask for user confirmation"""
-    response = input(prompt).strip().lower()
+    with trace_span(f"confirm: {prompt.strip()}"):
+        response = input(prompt).strip().lower()
     return response in ['y', 'yes']
 
+class KubectlBackend:
+    """Cluster backend running kubectl in a subprocess for every operation"""
+    name = "kubectl"
+
+    def apply(self, content, source):
+        """Apply rendered manifest content, streamed to kubectl through stdin"""
+        return execute_command("kubectl apply -f -", input=content)
+
+    def apply_url(self, url):
+        """Apply a remote manifest"""
+        return execute_command(f"kubectl apply -f {url}")
+
+    def namespace_exists(self, name):
+        return execute_command(f"kubectl get namespace {name}", quiet=True)
+
+    def deployment_exists(self, name, namespace="default"):
+        return execute_command(f"kubectl get deployment {name} --namespace {namespace}", quiet=True)
+
+    def watch(self, api_version, kind, name, namespace, deadline):
+        """Yield snapshots of an object until `deadline`, polling with exponential backoff"""
+        backoff = READY_BACKOFF_INITIAL
+        while True:
+            with trace_span(f"$ kubectl get {kind.lower()} {name}", subprocess=True) as span:
+                result = subprocess.run(
+                    ["kubectl", "get", kind.lower(), name, "--namespace", namespace, "-o", "json"],
+                    capture_output=True, text=True
+                )
+                span.status = f"exit {result.returncode}"
+
+            if result.returncode == 0:
+                yield json.loads(result.stdout)
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return
+            time.sleep(min(backoff, remaining))
+            backoff = min(backoff * 2, READY_BACKOFF_MAX)
+
+def _merge_fields(target, fields):
+    """Merge a managedFields fieldsV1 tree into `target`, in place"""
+    for key, value in fields.items():
+        if isinstance(value, dict) and isinstance(target.get(key), dict):
+            _merge_fields(target[key], value)
+        else:
+            target[key] = json.loads(json.dumps(value))
+
+class KubeApiBackend:
+    """
+    Cluster backend talking to the Kubernetes API server in-process.
+    All requests share one pooled HTTP session; manifests are applied with
+    server-side apply and existence checks are plain GETs. Fields owned by
+    other managers (e.g. a previous kubectl apply) are only taken over when
+    force_conflicts is set; otherwise the conflict fails the apply.
+    """
+    name = "api"
+    field_manager = "deploy-py"
+
+    def __init__(self, server, token=None, ca_cert=None, client_cert=None,
+                 namespace="default", verify=True, pool_size=DEFAULT_JOBS,
+                 force_conflicts=False):
+        import requests
+        from requests.adapters import HTTPAdapter
+
+        self.server = server.rstrip('/')
+        self.namespace = namespace
+        self.force_conflicts = force_conflicts
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max(pool_size, 1))
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.session.verify = ca_cert if (verify and ca_cert) else verify
+        if client_cert:
+            self.session.cert = client_cert
+        if token:
+            self.session.headers["Authorization"] = f"Bearer {token}"
+        self._resources = {}
+        self._resources_lock = threading.Lock()
+
+    def _resource(self, api_version, kind):
+        """Resolve (plural name, namespaced) for a kind through API discovery"""
+        with self._resources_lock:
+            if api_version not in self._resources:
+                base = "/api/v1" if api_version == "v1" else f"/apis/{api_version}"
+                resp = self.session.get(self.server + base, timeout=30)
+                resp.raise_for_status()
+                self._resources[api_version] = {
+                    r["kind"]: (r["name"], r["namespaced"])
+                    for r in resp.json().get("resources", [])
+                    if "/" not in r["name"]
+                }
+        try:
+            return self._resources[api_version][kind]
+        except KeyError:
+            raise ValueError(f"Unknown resource kind {kind} in {api_version}")
+
+    def _collection_url(self, api_version, kind, namespace=None):
+        plural, namespaced = self._resource(api_version, kind)
+        base = "/api/v1" if api_version == "v1" else f"/apis/{api_version}"
+        if namespaced:
+            return f"{self.server}{base}/namespaces/{namespace or self.namespace}/{plural}"
+        return f"{self.server}{base}/{plural}"
+
+    def _object_url(self, api_version, kind, name, namespace=None):
+        return f"{self._collection_url(api_version, kind, namespace)}/{name}"
+
+    def _exists(self, api_version, kind, name, namespace=None):
+        resp = self.session.get(self._object_url(api_version, kind, name, namespace), timeout=30)
+        if resp.status_code == 404:
+            return False
+        resp.raise_for_status()
+        return True
+
+    def _upgrade_managed_fields(self, url, api_version):
+        """
+        Move the fields of an existing object owned by client-side apply to
+        this backend's server-side apply manager. The managedFields are
+        replaced with a JSON patch guarded by the object's resourceVersion.
+        """
+        resp = self.session.get(url, timeout=30)
+        if resp.status_code == 404:
+            return
+        resp.raise_for_status()
+        metadata = resp.json().get("metadata") or {}
+        managed = metadata.get("managedFields") or []
+        client_side = [
+            entry for entry in managed
+            if entry.get("operation") == "Update"
+            and entry.get("manager") in (CSA_FIELD_MANAGER, self.field_manager)
+        ]
+        if not client_side:
+            return
+
+        fields = {}
+        for entry in client_side:
+            _merge_fields(fields, entry.get("fieldsV1") or {})
+        kept = [entry for entry in managed if entry not in client_side]
+        for entry in kept:
+            if entry.get("manager") == self.field_manager and entry.get("operation") == "Apply":
+                _merge_fields(entry.setdefault("fieldsV1", {}), fields)
+                break
+        else:
+            kept.append({
+                "manager": self.field_manager,
+                "operation": "Apply",
+                "apiVersion": api_version,
+                "time": client_side[-1].get("time"),
+                "fieldsType": "FieldsV1",
+                "fieldsV1": fields,
+            })
+
+        patch = [
+            {"op": "test", "path": "/metadata/resourceVersion", "value": metadata.get("resourceVersion")},
+            {"op": "replace", "path": "/metadata/managedFields", "value": kept},
+        ]
+        resp = self.session.patch(url, data=json.dumps(patch),
+                                  headers={"Content-Type": "application/json-patch+json"}, timeout=60)
+        resp.raise_for_status()
+
+    def apply(self, content, source):
+        """
+        Server-side apply every document of rendered manifest content. Fields
+        of objects last applied by client-side kubectl are taken over first.
+        """
+        import yaml
+
+        try:
+            documents = [doc for doc in yaml.safe_load_all(content) if doc]
+        except yaml.YAMLError as e:
+            print(f"Error: Invalid YAML in {source}: {str(e)}")
+            return False
+
+        params = {"fieldManager": self.field_manager}
+        if self.force_conflicts:
+            params["force"] = "true"
+
+        for doc in documents:
+            kind = doc.get("kind", "")
+            metadata = doc.get("metadata") or {}
+            try:
+                url = self._object_url(doc.get("apiVersion", ""), kind,
+                                       metadata.get("name", ""), metadata.get("namespace"))
+                self._upgrade_managed_fields(url, doc.get("apiVersion", ""))
+                resp = self.session.patch(
+                    url,
+                    params=params,
+                    data=json.dumps(doc),
+                    headers={"Content-Type": "application/apply-patch+yaml"},
+                    timeout=60,
+                )
+            except Exception as e:
+                print(f"Error applying {kind}/{metadata.get('name')} from {source}: {str(e)}")
+                return False
+            if resp.status_code >= 400:
+                try:
+                    message = resp.json().get("message", resp.text)
+                except ValueError:
+                    message = resp.text
+                print(f"Error applying {kind}/{metadata.get('name')} from {source}: {message}")
+                if resp.status_code == 409 and not self.force_conflicts:
+                    print("Use --force-conflicts to take over the conflicting fields")
+                return False
+            print(f"{kind.lower()}/{metadata.get('name')} serverside-applied")
+        return True
+
+    def apply_url(self, url):
+        """Download and apply a remote manifest"""
+        import requests
+
+        # Not through self.session: it carries the cluster credentials
+        try:
+            resp = requests.get(url, timeout=60)
+            resp.raise_for_status()
+        except Exception as e:
+            print(f"Error downloading {url}: {str(e)}")
+            return False
+        return self.apply(resp.text, url)
+
+    def namespace_exists(self, name):
+        return self._exists("v1", "Namespace", name)
+
+    def deployment_exists(self, name, namespace="default"):
+        return self._exists("apps/v1", "Deployment", name, namespace)
+
+    def watch(self, api_version, kind, name, namespace, deadline):
+        """
+        Yield snapshots of an object until `deadline`: the current state first,
+        then every change streamed by a watch request. Broken or expired watches
+        are re-listed with exponential backoff.
+        """
+        url = self._collection_url(api_version, kind, namespace)
+        selector = f"metadata.name={name}"
+        backoff = READY_BACKOFF_INITIAL
+        while time.monotonic() < deadline:
+            try:
+                resp = self.session.get(url, params={"fieldSelector": selector}, timeout=30)
+                resp.raise_for_status()
+                listing = resp.json()
+                for item in listing.get("items", []):
+                    yield item
+
+                remaining = int(deadline - time.monotonic())
+                if remaining <= 0:
+                    return
+                params = {
+                    "watch": "true",
+                    "fieldSelector": selector,
+                    "resourceVersion": listing.get("metadata", {}).get("resourceVersion", ""),
+                    "timeoutSeconds": remaining,
+                }
+                with self.session.get(url, params=params, stream=True,
+                                      timeout=(30, remaining + 30)) as stream:
+                    stream.raise_for_status()
+                    for line in stream.iter_lines():
+                        if not line:
+                            continue
+                        event = json.loads(line)
+                        if event.get("type") == "ERROR":
+                            break  # e.g. 410 Gone: the resourceVersion expired, re-list
+                        if event.get("type") in ("ADDED", "MODIFIED"):
+                            backoff = READY_BACKOFF_INITIAL
+                            yield event["object"]
+                continue
+            except Exception as e:
+                print(f"Watch on {kind}/{name} interrupted: {str(e)}")
+            time.sleep(max(min(backoff, deadline - time.monotonic()), 0))
+            backoff = min(backoff * 2, READY_BACKOFF_MAX)
+
+def _kubeconfig_file(data_b64, path):
+    """Return a file path for a kubeconfig credential given inline (base64) or as a path"""
+    if path:
+        return os.path.expanduser(path)
+    if not data_b64:
+        return None
+    fd, tmp_path = tempfile.mkstemp(prefix="deploy-kube-")
+    with os.fdopen(fd, "wb") as f:
+        f.write(base64.b64decode(data_b64))
+    atexit.register(lambda: os.path.exists(tmp_path) and os.unlink(tmp_path))
+    return tmp_path
+
+def cluster_identity():
+    """
+    Return (context, server, namespace) of the current kubeconfig context, or
+    of the in-cluster service account, with None for what cannot be read.
+    Deploy state is recorded per cluster, so that switching contexts is not
+    mistaken for unchanged manifests. Read once per process.
+    """
+    global _cluster_identity
+    if _cluster_identity is not None:
+        return _cluster_identity
+
+    identity = (None, None, None)
+    config_path = os.environ.get("KUBECONFIG", "").split(os.pathsep)[0] \
+        or os.path.expanduser("~/.kube/config")
+    try:
+        if os.path.exists(config_path):
+            import yaml
+
+            with open(config_path) as f:
+                config = yaml.safe_load(f) or {}
+            name = config.get("current-context")
+            context = next((item.get("context") or {} for item in config.get("contexts") or []
+                            if item.get("name") == name), {})
+            cluster = next((item.get("cluster") or {} for item in config.get("clusters") or []
+                            if item.get("name") == context.get("cluster")), {})
+            identity = (name, cluster.get("server"), context.get("namespace", "default"))
+        elif os.environ.get("KUBERNETES_SERVICE_HOST"):
+            host = os.environ["KUBERNETES_SERVICE_HOST"]
+            port = os.environ.get("KUBERNETES_SERVICE_PORT", "443")
+            identity = ("in-cluster", f"https://{host}:{port}", None)
+    except (OSError, ValueError, AttributeError) as e:
+        print(f"Warning: Cannot read the kube context from {config_path}: {str(e)}")
+    _cluster_identity = identity
+    return identity
+
+def load_kube_api_backend(pool_size=DEFAULT_JOBS, force_conflicts=False):
+    """
+    Build a KubeApiBackend from the current kubeconfig context
+    (KUBECONFIG or ~/.kube/config), or from the in-cluster service account.
+    Raises ValueError if the configuration cannot be used in-process.
+    """
+    config_path = os.environ.get("KUBECONFIG", "").split(os.pathsep)[0] \
+        or os.path.expanduser("~/.kube/config")
+
+    if not os.path.exists(config_path):
+        sa_dir = Path("/var/run/secrets/kubernetes.io/serviceaccount")
+        host = os.environ.get("KUBERNETES_SERVICE_HOST")
+        if not host or not (sa_dir / "token").exists():
+            raise ValueError("no kubeconfig found")
+        namespace_file = sa_dir / "namespace"
+        return KubeApiBackend(
+            f"https://{host}:{os.environ.get('KUBERNETES_SERVICE_PORT', '443')}",
+            token=(sa_dir / "token").read_text().strip(),
+            ca_cert=str(sa_dir / "ca.crt"),
+            namespace=namespace_file.read_text().strip() if namespace_file.exists() else "default",
+            pool_size=pool_size,
+            force_conflicts=force_conflicts,
+        )
+
+    import yaml
+
+    with open(config_path) as f:
+        config = yaml.safe_load(f) or {}
+
+    def named(section, name):
+        for item in config.get(section) or []:
+            if item.get("name") == name:
+                return item
+        raise ValueError(f"{section[:-1]} {name} not found in {config_path}")
+
+    context = named("contexts", config.get("current-context"))["context"]
+    cluster = named("clusters", context["cluster"])["cluster"]
+    user = named("users", context["user"])["user"] if context.get("user") else {}
+
+    if "exec" in user or "auth-provider" in user:
+        raise ValueError("exec/auth-provider credentials are only supported by kubectl")
+
+    client_cert = None
+    cert_file = _kubeconfig_file(user.get("client-certificate-data"), user.get("client-certificate"))
+    key_file = _kubeconfig_file(user.get("client-key-data"), user.get("client-key"))
+    if cert_file and key_file:
+        client_cert = (cert_file, key_file)
+
+    token = user.get("token")
+    if not token and user.get("tokenFile"):
+        token = Path(user["tokenFile"]).read_text().strip()
+
+    return KubeApiBackend(
+        cluster["server"],
+        token=token,
+        ca_cert=_kubeconfig_file(cluster.get("certificate-authority-data"),
+                                 cluster.get("certificate-authority")),
+        client_cert=client_cert,
+        namespace=context.get("namespace", "default"),
+        verify=not cluster.get("insecure-skip-tls-verify", False),
+        pool_size=pool_size,
+        force_conflicts=force_conflicts,
+    )
+
+def set_cluster_backend(choice="kubectl", pool_size=DEFAULT_JOBS, force_conflicts=False):
+    """
+    Select the cluster backend: 'kubectl' (subprocess per operation, the
+    default), 'api' (in-process API client) or 'auto' (api, falling back to
+    kubectl).
+    force_conflicts lets server-side apply take over fields of other managers.
+    """
+    global _cluster_backend
+    if choice == "kubectl":
+        _cluster_backend = KubectlBackend()
+        return _cluster_backend
+    try:
+        _cluster_backend = load_kube_api_backend(pool_size, force_conflicts)
+    except Exception as e:
+        if choice == "api":
+            print(f"Error: Cannot use the Kubernetes API backend: {str(e)}")
+            sys.exit(1)
+        _cluster_backend = KubectlBackend()
+    return _cluster_backend
+
+def get_cluster_backend():
+    """Return the selected cluster backend, selecting the default if needed"""
+    if _cluster_backend is None:
+        set_cluster_backend()
+    return _cluster_backend
+
+def workload_ready(obj):
+    """
+    Check the rollout conditions of a Deployment, StatefulSet, DaemonSet or Pod.
+    Returns True when ready, False when still progressing, and raises
+    RuntimeError when the rollout can no longer succeed.
+    """
+    kind = obj.get("kind")
+    metadata = obj.get("metadata") or {}
+    spec = obj.get("spec") or {}
+    status = obj.get("status") or {}
+
+    if kind == "Pod":
+        if status.get("phase") == "Failed":
+            raise RuntimeError("pod failed")
+        if status.get("phase") == "Succeeded":
+            return True
+        return any(c.get("type") == "Ready" and c.get("status") == "True"
+                   for c in status.get("conditions") or [])
+
+    if status.get("observedGeneration", 0) < metadata.get("generation", 0):
+        return False
+
+    if kind == "Deployment":
+        for condition in status.get("conditions") or []:
+            if condition.get("reason") == "ProgressDeadlineExceeded":
+                raise RuntimeError(condition.get("message", "progress deadline exceeded"))
+        replicas = spec.get("replicas", 1)
+        return (status.get("updatedReplicas", 0) >= replicas
+                and status.get("replicas", 0) == status.get("updatedReplicas", 0)
+                and status.get("availableReplicas", 0) >= replicas)
+
+    if kind == "StatefulSet":
+        replicas = spec.get("replicas", 1)
+        if status.get("readyReplicas", 0) < replicas:
+            return False
+        if (spec.get("updateStrategy") or {}).get("type", "RollingUpdate") == "RollingUpdate":
+            return (status.get("updatedReplicas", 0) >= replicas
+                    and status.get("currentRevision") == status.get("updateRevision"))
+        return True
+
+    if kind == "DaemonSet":
+        desired = status.get("desiredNumberScheduled", 0)
+        return (status.get("updatedNumberScheduled", 0) >= desired
+                and status.get("numberAvailable", 0) >= desired)
+
+    return True
+
+def manifest_workloads(content):
+    """Return (apiVersion, kind, name, namespace) of the workloads defined in rendered content"""
+    import yaml
+
+    workloads = []
+    for doc in yaml.safe_load_all(content):
+        if doc and doc.get("kind") in WORKLOAD_KINDS:
+            metadata = doc.get("metadata") or {}
+            workloads.append((doc.get("apiVersion"), doc["kind"], metadata.get("name"),
+                              metadata.get("namespace", "default")))
+    return workloads
+
+def wait_for_workload(api_version, kind, name, namespace="default", timeout=DEFAULT_READY_TIMEOUT):
+    """Block until a workload is ready, returning as soon as its rollout conditions are met"""
+    start = time.monotonic()
+    deadline = start + timeout
+    with trace_span(f"wait {kind}/{name}") as span:
+        try:
+            for obj in get_cluster_backend().watch(api_version, kind, name, namespace, deadline):
+                if workload_ready(obj):
+                    print(f"✓ {kind}/{name} ready after {time.monotonic() - start:.1f}s")
+                    return True
+        except RuntimeError as e:
+            span.status = "failed"
+            print(f"✗ {kind}/{name} rollout failed: {str(e)}")
+            return False
+        span.status = "timeout"
+        print(f"✗ {kind}/{name} not ready after {timeout}s")
+        return False
+
+def wait_for_workloads(workloads, timeout=DEFAULT_READY_TIMEOUT):
+    """Block until all (apiVersion, kind, name, namespace) workloads are ready"""
+    return all([wait_for_workload(*workload, timeout=timeout) for workload in workloads])
+
 def create_secrets(env_vars):
     """Create secrets from 00-secrets.yaml"""
     print("\n1. Creating secrets...")
@@ -120,13 +942,10 @@ def create_secrets(env_vars):
 
     secrets_path = "./preliminary/00-secrets.yaml"
     processed_secrets = process_yaml(secrets_path, env_vars)
-    tmp_secrets_file = Path(f"/tmp/00-secrets.yaml")
-    tmp_secrets_file.write_text(processed_secrets)
 
-    if not execute_command(f"kubectl apply -f {tmp_secrets_file}"):
+    if not get_cluster_backend().apply(processed_secrets, secrets_path):
         print(f"Failed to apply {secrets_path}")
         sys.exit(1)
-    tmp_secrets_file.unlink()
     print("Secrets created successfully.")
 
 def install_metallb(env_vars):
@@ -136,44 +955,27 @@ def install_metallb(env_vars):
         print("Skipping MetalLB installation.")
         return
 
-    result = subprocess.run(
-        "kubectl get namespace metallb-system",
-        shell=True, capture_output=True, text=True
-    )
-
-    if result.returncode == 0:  # MetalLB is already installed
+    backend = get_cluster_backend()
+    if backend.namespace_exists("metallb-system"):  # MetalLB is already installed
         print("MetalLB is already installed. Skipping installation.")
     else:
         print("MetalLB not found. Installing MetalLB...")
-        if not execute_command("kubectl apply -f https://raw.githubusercontent.com/metallb/metallb/v0.13.7/config/manifests/metallb-native.yaml"):
+        if not backend.apply_url("https://raw.githubusercontent.com/metallb/metallb/v0.13.7/config/manifests/metallb-native.yaml"):
             print("Failed to install MetalLB.")
             sys.exit(1)
 
     print("Waiting for MetalLB pods to be ready...")
-    ready = False
-    for _ in range(10):  # Check readiness for up to 5 minutes
-        time.sleep(30)
-        pods = subprocess.run(
-            "kubectl get pods -n metallb-system -o jsonpath='{.items[*].status.containerStatuses[*].ready}'",
-            shell=True, capture_output=True, text=True
-        )
-        if "false" not in pods.stdout and "true" in pods.stdout:
-            ready = True
-            break
-    if not ready:
+    if not wait_for_workloads(METALLB_WORKLOADS, timeout=300):
         print("MetalLB pods are not ready. Please check the logs.")
         sys.exit(1)
 
     print("\nConfiguring MetalLB with 01-metallb-config.yaml...")
     metallb_config_path = "./preliminary/01-metallb-config.yaml"
     processed_content = process_yaml(metallb_config_path, env_vars)
-    tmp_file = Path(f"/tmp/01-metallb-config.yaml")
-    tmp_file.write_text(processed_content)
 
-    if not execute_command(f"kubectl apply -f {tmp_file}"):
+    if not backend.apply(processed_content, metallb_config_path):
         print(f"Failed to apply {metallb_config_path}")
         sys.exit(1)
-    tmp_file.unlink()
 
     print("MetalLB installed and configured successfully.")
 
@@ -187,13 +989,10 @@ def configure_storage(env_vars):
 
     storage_path = "./preliminary/02-storage.yaml"
     processed_storage = process_yaml(storage_path, env_vars)
-    tmp_storage_file = Path(f"/tmp/02-storage.yaml")
-    tmp_storage_file.write_text(processed_storage)
 
-    if not execute_command(f"kubectl apply -f {tmp_storage_file}"):
+    if not get_cluster_backend().apply(processed_storage, storage_path):
         print(f"Failed to apply {storage_path}")
         sys.exit(1)
-    tmp_storage_file.unlink()
     print("Storage configured successfully.")
 
 def install_traefik(env_vars):
@@ -218,18 +1017,18 @@ def install_traefik(env_vars):
     values_file_path = "./preliminary/03-traefik-values.yaml"
     print(f"Processing {values_file_path} for variable substitution...")
     
-    # Create a temporary file with processed values
+    # Processed values are streamed to Helm through stdin
     processed_values = process_yaml(values_file_path, env_vars)
-    tmp_values_file = Path("/tmp/03-traefik-values.yaml")
-    tmp_values_file.write_text(processed_values)
 
     # First, verify if Traefik repository exists
     print("Checking Traefik Helm repository status...")
-    repo_check = subprocess.run(
-        "helm repo list | grep traefik",
-        shell=True, capture_output=True, text=True,
-        env=helm_env
-    )
+    with trace_span("$ helm repo list | grep traefik", subprocess=True) as span:
+        repo_check = subprocess.run(
+            "helm repo list | grep traefik",
+            shell=True, capture_output=True, text=True,
+            env=helm_env
+        )
+        span.status = f"exit {repo_check.returncode}"
     
     # Add repository if not found
     if repo_check.returncode != 0:
@@ -245,47 +1044,38 @@ def install_traefik(env_vars):
         sys.exit(1)
 
     # Check if Traefik is already installed
-    result = subprocess.run(
-        "kubectl get deployment traefik --namespace default",
-        shell=True, capture_output=True, text=True,
-        env=helm_env
-    )
+    traefik_installed = get_cluster_backend().deployment_exists("traefik", "default")
 
-    try:
-        if result.returncode != 0:  # Traefik not found
-            print("Traefik not found in the cluster. Installing Traefik...")
+    if not traefik_installed:  # Traefik not found
+        print("Traefik not found in the cluster. Installing Traefik...")
+        
+        # Install Traefik using Helm with processed values file
+        install_command = (
+            "helm install --values=- traefik traefik/traefik "
+            "--namespace default"
+        )
+        if not execute_command(install_command, env=helm_env, quiet=False, input=processed_values):
+            print("Failed to install Traefik.")
+            sys.exit(1)
+
+        print("Traefik installed successfully.")
+    else:
+        print("Traefik is already installed in the cluster.")
+        if confirm("Do you want to update Traefik's configuration? [y/N] "):
+            print("Updating Traefik configuration...")
             
-            # Install Traefik using Helm with processed values file
-            install_command = (
-                f"helm install --values={tmp_values_file} traefik traefik/traefik "
+            # Update Traefik using Helm upgrade with processed values file
+            upgrade_command = (
+                "helm upgrade --values=- traefik traefik/traefik "
                 "--namespace default"
             )
-            if not execute_command(install_command, env=helm_env, quiet=False):
-                print("Failed to install Traefik.")
+            if not execute_command(upgrade_command, env=helm_env, quiet=False, input=processed_values):
+                print("Failed to update Traefik configuration.")
                 sys.exit(1)
-
-            print("Traefik installed successfully.")
-        else:
-            print("Traefik is already installed in the cluster.")
-            if confirm("Do you want to update Traefik's configuration? [y/N] "):
-                print("Updating Traefik configuration...")
                 
-                # Update Traefik using Helm upgrade with processed values file
-                upgrade_command = (
-                    f"helm upgrade --values={tmp_values_file} traefik traefik/traefik "
-                    "--namespace default"
-                )
-                if not execute_command(upgrade_command, env=helm_env, quiet=False):
-                    print("Failed to update Traefik configuration.")
-                    sys.exit(1)
-                    
-                print("Traefik configuration updated successfully.")
-            else:
-                print("Skipping Traefik configuration update.")
-    finally:
-        # Clean up the temporary file
-        if tmp_values_file.exists():
-            tmp_values_file.unlink()
+            print("Traefik configuration updated successfully.")
+        else:
+            print("Skipping Traefik configuration update.")
 
 def configure_dashboard(env_vars):
     """Configure the Traefik dashboard"""
@@ -296,13 +1086,10 @@ def configure_dashboard(env_vars):
 
     dashboard_path = "./preliminary/04-traefik-dashboard.yaml"
     processed_dashboard = process_yaml(dashboard_path, env_vars)
-    tmp_dashboard_file = Path(f"/tmp/04-traefik-dashboard.yaml")
-    tmp_dashboard_file.write_text(processed_dashboard)
 
-    if not execute_command(f"kubectl apply -f {tmp_dashboard_file}"):
+    if not get_cluster_backend().apply(processed_dashboard, dashboard_path):
         print(f"Failed to apply {dashboard_path}")
         sys.exit(1)
-    tmp_dashboard_file.unlink()
     print("Traefik dashboard configured successfully.")
 
 def init_infrastructure():
@@ -319,44 +1106,365 @@ def init_infrastructure():
 
     # Check Helm installation
     print("\nStep 0: Checking Helm installation...")
-    check_helm_installation()
+    with trace_span("check helm"):
+        check_helm_installation()
     
     
-    env_vars = load_environment()
+    with trace_span("load environment"):
+        env_vars = load_environment()
 
     print("\nEnvironment variables:")
     for key, value in sorted(env_vars.items()):
         if not key.startswith('_'):
             print(f"{key}={value}")
 
-    create_secrets(env_vars)
-    install_metallb(env_vars)
-    configure_storage(env_vars)
-    install_traefik(env_vars)
-    configure_dashboard(env_vars)
+    for step in (create_secrets, install_metallb, configure_storage,
+                 install_traefik, configure_dashboard):
+        with trace_span(step.__name__.replace('_', ' ')):
+            step(env_vars)
 
     print("Infrastructure initialization completed.")
 
-def deploy_manifest(manifest_path):
+def read_deploy_state(manifest_path):
+    """Return the recorded state of the last successful apply of a manifest, or None"""
+    state_file = DEPLOY_STATE_DIR / f"{Path(manifest_path).name}.json"
+    try:
+        return json.loads(state_file.read_text())
+    except (OSError, ValueError):
+        return None
+
+def record_deploy_state(manifest_path, content_hash):
+    """Record the content hash, cluster and time of a successful apply of a manifest"""
+    DEPLOY_STATE_DIR.mkdir(exist_ok=True)
+    state_file = DEPLOY_STATE_DIR / f"{Path(manifest_path).name}.json"
+    tmp_file = state_file.with_suffix(".tmp")
+    context, server, namespace = cluster_identity()
+    tmp_file.write_text(json.dumps({
+        "manifest": str(manifest_path),
+        "hash": content_hash,
+        "context": context,
+        "server": server,
+        "namespace": namespace,
+        "applied_at": datetime.datetime.now().isoformat(timespec='seconds'),
+    }, indent=2))
+    os.replace(tmp_file, state_file)
+
+def render_manifest(manifest_path, env_vars, changed_only=False, force=False):
+    """
+    Render a manifest for apply.
+    Returns (content, content_hash, skip): skip is None when the manifest must be
+    applied, otherwise the (status, reason) to report instead: 'failed' for
+    unresolved placeholders, 'unchanged' when changed_only is set and the hash
+    matches the last successful apply (unless force is set). The hash covers
+    the cluster (kube context, API server and namespace) as well, so a
+    manifest applied to another cluster counts as changed.
+    """
+    processed_content, _, unresolved = render_template(manifest_path, env_vars)
+    if unresolved:
+        names = ", ".join(f"${{{name}}}" for name in sorted(unresolved))
+        print(f"Error: Unresolved placeholders in {manifest_path}: {names}")
+        return processed_content, None, ("failed", f"unresolved placeholders {names}")
+
+    cluster = json.dumps(cluster_identity())
+    content_hash = hashlib.sha256(f"{cluster}\n{processed_content}".encode()).hexdigest()
+    if changed_only and not force:
+        state = read_deploy_state(manifest_path)
+        if state and state.get("hash") == content_hash:
+            reason = f"unchanged since {state.get('applied_at')}"
+            print(f"Skipping {manifest_path}: {reason}")
+            return processed_content, content_hash, ("unchanged", reason)
+
+    return processed_content, content_hash, None
+
+def apply_manifest(manifest_path, env_vars, changed_only=False, force=False,
+                   wait=False, wait_timeout=DEFAULT_READY_TIMEOUT):
+    """
+    Render and apply a manifest file.
+    With changed_only, the apply is skipped when the rendered content hash matches
+    the last successful apply recorded in .deploy-state/ (unless force is set).
+    With wait, blocks until the workloads defined in the manifest are ready.
+    Returns (status, reason) where status is 'applied', 'unchanged' or 'failed'.
+    """
+    with trace_span("render"):
+        processed_content, content_hash, skip = render_manifest(manifest_path, env_vars, changed_only, force)
+    if skip:
+        return skip
+
+    print(f"Applying {manifest_path}...")
+    backend = get_cluster_backend()
+    with trace_span(f"{backend.name} apply") as span:
+        if not backend.apply(processed_content, manifest_path):
+            span.status = "failed"
+            return "failed", f"{backend.name} apply failed"
+
+    if wait:
+        with trace_span("wait for workloads"):
+            if not wait_for_workloads(manifest_workloads(processed_content), wait_timeout):
+                return "failed", "workloads not ready"
+    # Only a complete deploy is recorded, so --changed-only retries failed waits
+    record_deploy_state(manifest_path, content_hash)
+    return "applied", ""
+
+def deploy_manifest(manifest_path, env_vars=None, changed_only=False, force=False,
+                    wait=False, wait_timeout=DEFAULT_READY_TIMEOUT):
     """Deploy a specific manifest file"""
     if not os.path.exists(manifest_path):
         print(f"Error: File {manifest_path} not found")
         return False
 
-    env_vars = load_environment()
-    print(f"Applying {manifest_path}...")
-    
-    processed_content = process_yaml(manifest_path, env_vars)
-    tmp_file = Path(f"/tmp/{Path(manifest_path).name}")
-    tmp_file.write_text(processed_content)
+    if env_vars is None:
+        env_vars = load_environment()
+    status, _ = apply_manifest(manifest_path, env_vars, changed_only, force, wait, wait_timeout)
+    return status != "failed"
 
-    success = execute_command(f"kubectl apply -f {tmp_file}")
-    tmp_file.unlink()
-    
-    return success
+def manifest_prefix(manifest):
+    """Return the numeric prefix of a manifest file name (e.g. 6 for 06-oc-splitted-sparql.yaml)"""
+    match = re.match(r'(\d+)-', Path(manifest).name)
+    return int(match.group(1)) if match else None
 
-def deploy_all_manifests():
-    """Deploy all manifests in the manifests directory"""
+def read_depends_on(manifest):
+    """
+    Return the value of the '# dependsOn:' line of a manifest, or None. Only the
+    leading comment header is read (blank and comment lines before the first
+    other line or '---'), so such lines inside embedded scripts or ConfigMap
+    bodies are ignored.
+    """
+    with open(manifest) as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            if not line.startswith('#'):
+                return None
+            declared = DEPENDS_ON_PATTERN.match(line)
+            if declared:
+                return declared.group(1)
+    return None
+
+def build_dependency_graph(manifests):
+    """
+    Build the apply dependency graph of a set of manifests.
+
+    By default a manifest depends on every manifest with a lower numeric prefix,
+    and manifests without a prefix depend on all prefixed ones. A '# dependsOn:'
+    line in the leading comment header replaces the default with the listed prefixes.
+
+    Returns a dict mapping each manifest to the set of manifests it waits for.
+    """
+    by_prefix = {}
+    for manifest in manifests:
+        by_prefix.setdefault(manifest_prefix(manifest), set()).add(manifest)
+
+    graph = {}
+    for manifest in manifests:
+        prefix = manifest_prefix(manifest)
+        declared = read_depends_on(manifest)
+        if declared is not None:
+            deps = set()
+            for item in re.split(r'[,\s]+', declared):
+                if not item or item.lower() == 'none':
+                    continue
+                if not item.isdigit():
+                    print(f"Warning: Invalid dependsOn entry '{item}' in {manifest}")
+                    continue
+                if int(item) not in by_prefix:
+                    print(f"Warning: {manifest} depends on {item}, which is not being deployed")
+                    continue
+                deps |= by_prefix[int(item)]
+        elif prefix is None:
+            deps = {m for m in manifests if manifest_prefix(m) is not None}
+        else:
+            deps = {m for m in manifests
+                    if manifest_prefix(m) is not None and manifest_prefix(m) < prefix}
+        deps.discard(manifest)
+        graph[manifest] = deps
+    return graph
+
+def _timed_deploy(manifest, env_vars, changed_only, force, wait, wait_timeout, parent=None):
+    """Apply a manifest in a span under `parent` and return (status, reason, elapsed seconds)"""
+    start = time.monotonic()
+    with trace_span(f"deploy {manifest}", parent=parent) as span:
+        status, reason = apply_manifest(manifest, env_vars, changed_only, force, wait, wait_timeout)
+        span.status = status
+    return status, reason, time.monotonic() - start
+
+def apply_manifests(manifests, env_vars, jobs=DEFAULT_JOBS, changed_only=False, force=False,
+                    wait=False, wait_timeout=DEFAULT_READY_TIMEOUT):
+    """
+    Apply manifests concurrently, respecting the dependency graph.
+    A manifest starts as soon as all its dependencies were applied successfully
+    (or skipped as unchanged) and, with wait, their workloads are ready;
+    manifests depending on a failed one are skipped.
+    At most `jobs` applies run at the same time. Prints a timing summary and
+    returns True if all succeeded.
+    """
+    graph = build_dependency_graph(manifests)
+    pending = dict(graph)
+    done, failed = set(), set()
+    results = {}
+    running = {}
+    start = time.monotonic()
+    parent = current_span()
+
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+        while pending or running:
+            # Skip (transitively) everything that depends on a failed manifest
+            blocked = [m for m, deps in pending.items() if deps & failed]
+            while blocked:
+                for manifest in blocked:
+                    del pending[manifest]
+                    failed.add(manifest)
+                    results[manifest] = ("skipped", "a dependency failed", 0.0)
+                blocked = [m for m, deps in pending.items() if deps & failed]
+
+            for manifest in sorted(m for m, deps in pending.items() if deps <= done):
+                del pending[manifest]
+                future = pool.submit(_timed_deploy, manifest, env_vars,
+                                     changed_only, force, wait, wait_timeout, parent)
+                running[future] = manifest
+
+            if not running:
+                if pending:
+                    print("Error: Circular dependsOn declarations between:")
+                    for manifest in sorted(pending):
+                        print(f"  - {manifest}")
+                        failed.add(manifest)
+                        results[manifest] = ("skipped", "circular dependsOn", 0.0)
+                break
+
+            finished, _ = wait_for_futures(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                manifest = running.pop(future)
+                try:
+                    status, reason, elapsed = future.result()
+                except Exception as e:
+                    print(f"✗ Error applying {manifest}: {str(e)}")
+                    status, reason, elapsed = "failed", str(e), 0.0
+                results[manifest] = (status, reason, elapsed)
+                if status == "failed":
+                    failed.add(manifest)
+                    print(f"Failed to apply {manifest}")
+                else:
+                    done.add(manifest)
+
+    serial = sum(elapsed for _, _, elapsed in results.values())
+    print_deploy_summary(manifests, results, time.monotonic() - start,
+                         f"{serial:.2f}s of applies, {jobs} jobs")
+    return not failed
+
+def dependency_levels(graph):
+    """
+    Split a dependency graph into levels: every manifest of a level depends only
+    on manifests of previous levels. Returns (levels, cyclic) where cyclic is the
+    list of manifests that cannot be ordered because of circular dependencies.
+    """
+    levels = []
+    placed = set()
+    remaining = dict(graph)
+    while remaining:
+        level = sorted(m for m, deps in remaining.items() if deps <= placed)
+        if not level:
+            break
+        levels.append(level)
+        placed.update(level)
+        for manifest in level:
+            del remaining[manifest]
+    return levels, sorted(remaining)
+
+def apply_manifest_batches(manifests, env_vars, changed_only=False, force=False,
+                           wait=False, wait_timeout=DEFAULT_READY_TIMEOUT):
+    """
+    Apply manifests one dependency level at a time, concatenating the rendered
+    manifests of each level into a single multi-document apply call.
+    A failed apply marks every manifest of its batch as failed and skips the
+    manifests depending on them. Prints a timing summary and returns True if
+    all succeeded.
+    """
+    graph = build_dependency_graph(manifests)
+    levels, cyclic = dependency_levels(graph)
+    backend = get_cluster_backend()
+    failed = set()
+    results = {}
+    start = time.monotonic()
+
+    if cyclic:
+        print("Error: Circular dependsOn declarations between:")
+        for manifest in cyclic:
+            print(f"  - {manifest}")
+            failed.add(manifest)
+            results[manifest] = ("skipped", "circular dependsOn", 0.0)
+
+    for number, level in enumerate(levels, 1):
+        batch = []
+        with trace_span(f"render level {number}"):
+            for manifest in level:
+                if graph[manifest] & failed:
+                    failed.add(manifest)
+                    results[manifest] = ("skipped", "a dependency failed", 0.0)
+                    continue
+                content, content_hash, skip = render_manifest(manifest, env_vars, changed_only, force)
+                if skip:
+                    results[manifest] = (*skip, 0.0)
+                    if skip[0] == "failed":
+                        failed.add(manifest)
+                    continue
+                batch.append((manifest, content, content_hash))
+        if not batch:
+            continue
+
+        print(f"\nApplying {len(batch)} manifests in one call:")
+        for manifest, _, _ in batch:
+            print(f"- {manifest}")
+        batch_start = time.monotonic()
+        stream = "\n---\n".join(content for _, content, _ in batch)
+        with trace_span(f"{backend.name} apply level {number} ({len(batch)} manifests)") as span:
+            success = backend.apply(stream, f"batch of {len(batch)} manifests")
+            if not success:
+                span.status = "failed"
+        if success and wait:
+            with trace_span(f"wait for level {number}"):
+                success = wait_for_workloads(manifest_workloads(stream), wait_timeout)
+        if success:
+            for manifest, _, content_hash in batch:
+                record_deploy_state(manifest, content_hash)
+        elapsed = time.monotonic() - batch_start
+
+        for manifest, _, _ in batch:
+            if success:
+                results[manifest] = ("applied", "", elapsed)
+            else:
+                failed.add(manifest)
+                results[manifest] = ("failed", f"{backend.name} batch apply failed", elapsed)
+                print(f"Failed to apply {manifest}")
+
+    print_deploy_summary(manifests, results, time.monotonic() - start, f"{len(levels)} batches")
+    return not failed
+
+def print_deploy_summary(manifests, results, total, details):
+    """Print per-manifest status and timing, and the reason of every manifest not applied"""
+    print("\nDeployment summary:")
+    print("===================")
+    for manifest in manifests:
+        status, _, elapsed = results.get(manifest, ("skipped", "", 0.0))
+        print(f"  {status:<9} {elapsed:7.2f}s  {manifest}")
+    print(f"\nTotal: {total:.2f}s wall clock ({details})")
+
+    skipped = [(m, results[m][1]) for m in manifests
+               if results.get(m, ("",))[0] in ("unchanged", "skipped")]
+    if skipped:
+        print("\nNot applied:")
+        for manifest, reason in skipped:
+            print(f"  - {manifest}: {reason}")
+
+def deploy_all_manifests(jobs=DEFAULT_JOBS, changed_only=False, force=False,
+                         wait=False, wait_timeout=DEFAULT_READY_TIMEOUT, batch=False):
+    """
+    Deploy all manifests in the manifests directory.
+    With changed_only, manifests whose rendered content did not change since
+    their last successful apply are skipped (force applies them anyway).
+    With wait, each manifest's workloads must be ready before its dependents start.
+    With batch, each dependency level is applied with a single apply call.
+    """
     manifests_dir = Path('manifests')
     if not manifests_dir.exists():
         print("Error: manifests directory not found")
@@ -367,7 +1475,8 @@ def deploy_all_manifests():
     for manifest in manifests:
         print(f"- {manifest}")
 
-    env_vars = load_environment()
+    with trace_span("load environment"):
+        env_vars = load_environment()
 
     print("\nEnvironment variables:")
     for key, value in sorted(env_vars.items()):
@@ -378,10 +1487,14 @@ def deploy_all_manifests():
         print("Deployment cancelled.")
         return False
 
-    for manifest in manifests:
-        if not deploy_manifest(manifest):
-            return False
-    return True
+    with trace_span("apply manifests") as span:
+        if batch:
+            success = apply_manifest_batches(manifests, env_vars, changed_only, force, wait, wait_timeout)
+        else:
+            success = apply_manifests(manifests, env_vars, jobs, changed_only, force, wait, wait_timeout)
+        if not success:
+            span.status = "failed"
+    return success
 
 def preview_file(file_path):
     """
@@ -407,7 +1520,7 @@ def preview_file(file_path):
         print("=" * 80)  # Visual separator for better readability
         
         # Process the YAML file
-        processed_content = process_yaml(file_path, env_vars)
+        processed_content, used, unresolved = render_template(file_path, env_vars)
         
         # Print the processed content
         print(processed_content)
@@ -415,20 +1528,21 @@ def preview_file(file_path):
         
         # Print which variables were replaced
         # This helps users understand what substitutions were made
-        original_content = Path(file_path).read_text()
-        replacements = []
-        
-        for key, value in env_vars.items():
-            placeholder = f"${{{key}}}"
-            if placeholder in original_content:
-                replacements.append((key, value))
-        
-        if replacements:
+        if used:
             print("\nVariable substitutions made:")
-            for key, value in replacements:
-                print(f"  ${{{key}}} → {value}")
+            for key in sorted(used):
+                print(f"  ${{{key}}} → {env_vars[key]}")
         else:
             print("\nNo variable substitutions were needed in this file.")
+
+        unused_count = len(set(env_vars) - used)
+        if unused_count:
+            print(f"\n{unused_count} variables from .env are not used in this file.")
+
+        if unresolved:
+            print("\n⚠ Unresolved placeholders (not defined in .env):")
+            for key in sorted(unresolved):
+                print(f"  ${{{key}}}")
             
     except Exception as e:
         print(f"Error while previewing file: {str(e)}")
@@ -449,6 +1563,8 @@ def create_production_files(output_dir="production-ready"):
     3. Process each manifest file, replacing variables
     4. Create a detailed summary including variable substitutions
     """
+    import yaml
+
     try:
         print("\nStarting Fleet Production Process...")
         print("====================================")
@@ -486,6 +1602,7 @@ def create_production_files(output_dir="production-ready"):
         
         # Keep track of which variables are used in which files
         file_var_usage = {}
+        file_unresolved = {}
         
         # Process each manifest file
         processed_count = 0
@@ -496,16 +1613,14 @@ def create_production_files(output_dir="production-ready"):
                 # Create corresponding output file path
                 output_file = output_path / source_file.name
                 
-                # Read original content to track variable usage
-                original_content = source_file.read_text()
-                used_vars = []
-                for key in env_vars:
-                    if f"${{{key}}}" in original_content:
-                        used_vars.append(key)
+                # Process the YAML file, tracking variable usage
+                processed_content, used_vars, unresolved = render_template(source_file, env_vars)
                 file_var_usage[source_file.name] = used_vars
-                
-                # Process the YAML file
-                processed_content = process_yaml(str(source_file), env_vars)
+                if unresolved:
+                    file_unresolved[source_file.name] = unresolved
+                    print(f"✗ Unresolved placeholders in {source_file.name}: "
+                          + ", ".join(f"${{{name}}}" for name in sorted(unresolved)))
+                    continue
                 
                 # Write the processed content to the output file
                 output_file.write_text(processed_content)
@@ -584,6 +1699,18 @@ def create_production_files(output_dir="production-ready"):
                 if not key.startswith('_'):  # Skip internal variables
                     summary_content.append(f"- ${{{key}}} → {env_vars[key]}")
         
+        # Add section for unresolved placeholders
+        if file_unresolved:
+            summary_content.extend([
+                "",
+                "### Unresolved Placeholders:",
+                "The following files were not generated because these placeholders are not defined:",
+                ""
+            ])
+            for filename in sorted(file_unresolved):
+                names = ", ".join(f"${{{name}}}" for name in sorted(file_unresolved[filename]))
+                summary_content.append(f"- {filename}: {names}")
+
         # Write the summary file
         summary_file.write_text('\n'.join(summary_content))
         
@@ -647,13 +1774,51 @@ def show_changes(original_files, new_files):
             
     return True
 
+def git_blob_hash(data):
+    """Return the git object id of a blob with the given content"""
+    return hashlib.sha1(b"blob %d\0" % len(data) + data).hexdigest()
+
+def sync_fleet_repo(repo_path, repo_url, auth_repo_url, branch_name):
+    """
+    Bring the cached shallow working copy of the fleet repository up to date
+    with the remote branch, cloning it (depth 1, single branch) on first use.
+    Credentials are passed on the command line only and never stored in the copy.
+    """
+    import git
+
+    if (repo_path / ".git").exists():
+        try:
+            repo = git.Repo(repo_path)
+            with trace_span("$ git fetch", subprocess=True):
+                repo.git.fetch(auth_repo_url, branch_name, depth=1)
+            with trace_span("$ git checkout", subprocess=True):
+                repo.git.checkout("-B", branch_name, "FETCH_HEAD", force=True)
+            with trace_span("$ git clean", subprocess=True):
+                repo.git.clean("-fdx")
+            return repo
+        except git.exc.GitError as e:
+            print(f"Cached fleet repository unusable, cloning again: {type(e).__name__}")
+            shutil.rmtree(repo_path)
+
+    repo_path.parent.mkdir(parents=True, exist_ok=True)
+    with trace_span("$ git clone", subprocess=True):
+        repo = git.Repo.clone_from(auth_repo_url, repo_path, depth=1,
+                                   single_branch=True, branch=branch_name)
+    repo.remotes.origin.set_url(repo_url)
+    return repo
+
 def create_production_files_and_push(output_dir="production-ready"):
     """
     Creates production files and pushes them to a private repository on the `main` branch,
     showing a change plan first.
     It also handles the removal of files that are no longer present in the local manifests.
+    The repository is kept as a shallow working copy in .deploy-state/ and only
+    changed files are written and committed.
     """
-    repo_path = Path("/tmp/private-repo")
+    import git
+    import yaml
+
+    repo_path = FLEET_REPO_DIR
     
     try:
         print("\nInitializing Fleet Production Process...")
@@ -661,7 +1826,8 @@ def create_production_files_and_push(output_dir="production-ready"):
 
         # Load environment variables
         print("\n1. Loading environment variables...")
-        env_vars = load_environment()
+        with trace_span("load environment"):
+            env_vars = load_environment()
         
         # Verify git credentials
         private_repo_url = env_vars.get("PRIVATE_REPO_URL")
@@ -680,47 +1846,67 @@ def create_production_files_and_push(output_dir="production-ready"):
         output_path = Path(output_dir)
         output_path.mkdir(exist_ok=True)
 
-        # Clone repository for comparison
-        print("\n2. Preparing change detection...")
-        if repo_path.exists():
-            shutil.rmtree(repo_path)
-        repo = git.Repo.clone_from(auth_repo_url, repo_path)
-        repo.git.checkout(branch_name)
-
-        # Read existing files from remote repository
-        existing_files = {
-            yaml_file.name: yaml_file.read_text()
-            for yaml_file in repo_path.glob("*.yaml")
-        }
-
         # Process new files from local manifests
-        print("\n3. Processing manifest files...")
+        print("\n2. Processing manifest files...")
         new_files = {}
         manifest_files = list(Path('manifests').glob('*.yaml'))
+        unresolved_files = {}
         
+        with trace_span("render and validate manifests"):
+            for source_file in manifest_files:
+                try:
+                    processed_content, _, unresolved = render_template(source_file, env_vars)
+                    if unresolved:
+                        unresolved_files[source_file.name] = unresolved
+                        continue
+                    # Validate YAML
+                    try:
+                        list(yaml.safe_load_all(processed_content))
+                        new_files[source_file.name] = processed_content
+                        print(f"✓ Validated: {source_file.name}")
+                    except yaml.YAMLError as e:
+                        print(f"⚠ Warning: Invalid YAML in {source_file.name}:")
+                        print(str(e))
+                except Exception as e:
+                    print(f"✗ Error processing {source_file.name}: {str(e)}")
+
+        # Never push manifests with placeholders missing from .env
+        if unresolved_files:
+            print("\nError: Unresolved placeholders found:")
+            for filename in sorted(unresolved_files):
+                names = ", ".join(f"${{{name}}}" for name in sorted(unresolved_files[filename]))
+                print(f"  ✗ {filename}: {names}")
+            sys.exit(1)
+
+        # Update the cached working copy for comparison
+        print("\n3. Preparing change detection...")
+        with trace_span("sync fleet repository"):
+            repo = sync_fleet_repo(repo_path, private_repo_url, auth_repo_url, branch_name)
+
+        # Hash existing files of the remote tree without reading them
+        existing_files = {
+            blob.name: blob.hexsha
+            for blob in repo.head.commit.tree.blobs
+            if blob.name.endswith(".yaml")
+        }
+        new_hashes = {
+            filename: git_blob_hash(content.encode())
+            for filename, content in new_files.items()
+        }
+
         # List of files present in local manifests
         local_manifest_names = set(source_file.name for source_file in manifest_files)
         
         # Identify files to remove (present in repo but not in local manifests)
         files_to_remove = set(existing_files.keys()) - local_manifest_names
-        
-        for source_file in manifest_files:
-            try:
-                processed_content = process_yaml(str(source_file), env_vars)
-                # Validate YAML
-                try:
-                    list(yaml.safe_load_all(processed_content))
-                    new_files[source_file.name] = processed_content
-                    print(f"✓ Validated: {source_file.name}")
-                except yaml.YAMLError as e:
-                    print(f"⚠ Warning: Invalid YAML in {source_file.name}:")
-                    print(str(e))
-            except Exception as e:
-                print(f"✗ Error processing {source_file.name}: {str(e)}")
+        changed_files = [
+            filename for filename in sorted(new_files)
+            if existing_files.get(filename) != new_hashes[filename]
+        ]
 
         # Show change plan including removals
         print("\n4. Generating change plan...")
-        if not show_changes(existing_files, new_files):
+        if not show_changes(existing_files, new_hashes):
             # Show removal files if any
             if files_to_remove:
                 print("\nFiles to be removed:")
@@ -747,32 +1933,35 @@ def create_production_files_and_push(output_dir="production-ready"):
             (output_path / filename).write_text(content)
             print(f"✓ Created: {filename}")
 
-        # Copy to repository and handle removals
+        # Write changed files to the repository and handle removals
         print("\n6. Updating repository...")
         
         # Remove files no longer present in local manifests
-        for file_to_remove in files_to_remove:
-            file_path = repo_path / file_to_remove
-            if file_path.exists():
-                file_path.unlink()
+        if files_to_remove:
+            repo.index.remove(sorted(files_to_remove), working_tree=True)
+            for file_to_remove in sorted(files_to_remove):
                 print(f"✓ Removed: {file_to_remove}")
 
-        # Copy new files
-        for file in output_path.glob("*.yaml"):
-            shutil.copy(file, repo_path / file.name)
+        # Write only added and modified files
+        with trace_span("update repository index"):
+            for filename in changed_files:
+                (repo_path / filename).write_text(new_files[filename])
+            if changed_files:
+                repo.index.add(changed_files)
 
         # Git operations
-        repo.git.add(all=True)
-        if repo.index.diff("HEAD") or repo.untracked_files or files_to_remove:
+        if changed_files or files_to_remove:
             try:
                 commit_message = f"Auto-update: {datetime.datetime.now().isoformat()}"
                 if files_to_remove:
                     commit_message += f"\n\nRemoved files:\n" + "\n".join(files_to_remove)
-                repo.git.commit(m=commit_message)
-                repo.remotes.origin.push(refspec=f"{branch_name}:{branch_name}")
+                with trace_span("$ git commit", subprocess=True):
+                    repo.git.commit(m=commit_message)
+                with trace_span("$ git push", subprocess=True):
+                    repo.git.push(auth_repo_url, f"HEAD:refs/heads/{branch_name}")
                 print("✓ Changes pushed successfully")
             except git.exc.GitCommandError as e:
-                print(f"Failed to push changes: {str(e)}")
+                print(f"Failed to push changes: {str(e).replace(git_token, '***')}")
                 sys.exit(1)
 
         print(f"""
@@ -787,10 +1976,6 @@ Fleet operation completed successfully!
     except Exception as e:
         print(f"\nError during operation: {str(e)}")
         sys.exit(1)
-    finally:
-        # Cleanup
-        if repo_path.exists():
-            shutil.rmtree(repo_path)
 
         
 def main():
@@ -798,20 +1983,57 @@ def main():
     parser.add_argument('-i', '--init', action='store_true', help='Initialize infrastructure')
     parser.add_argument('-p', '--preview', help='Preview a manifest or preliminary file with variable substitution')
     parser.add_argument('-f', '--fleet', action='store_true', help='Create production-ready versions of all manifests')
+    parser.add_argument('-j', '--jobs', type=int, default=DEFAULT_JOBS,
+                        help=f'Maximum number of manifests applied in parallel (default: {DEFAULT_JOBS})')
+    parser.add_argument('--changed-only', action='store_true',
+                        help='Apply only manifests whose rendered content changed since the last successful apply')
+    parser.add_argument('--force', action='store_true', help='Apply manifests even if unchanged (overrides --changed-only)')
+    parser.add_argument('--wait', action='store_true',
+                        help='Wait for the Deployments, StatefulSets, DaemonSets and Pods of each manifest to be ready')
+    parser.add_argument('--wait-timeout', type=int, default=DEFAULT_READY_TIMEOUT,
+                        help=f'Readiness timeout per workload in seconds (default: {DEFAULT_READY_TIMEOUT})')
+    parser.add_argument('--batch', action='store_true',
+                        help='Apply each dependency level of manifests with a single apply call')
+    parser.add_argument('--backend', choices=['kubectl', 'api', 'auto'], default='kubectl',
+                        help='Cluster backend: kubectl subprocesses, in-process API client, or api with kubectl fallback (default: kubectl)')
+    parser.add_argument('--force-conflicts', action='store_true',
+                        help='With the api backend, take over fields owned by other field managers on server-side apply conflicts')
+    parser.add_argument('--trace', action='store_true',
+                        help='Print the timed spans of the run and its critical path at the end')
+    parser.add_argument('--report', metavar='FILE',
+                        help='Write the timed spans of the run and its critical path as JSON to FILE')
     parser.add_argument('manifest', nargs='?', help='Specific manifest file to deploy')
     
     args = parser.parse_args()
+    if args.jobs < 1:
+        parser.error("--jobs must be at least 1")
 
-    if args.fleet:
-        create_production_files_and_push()
-    elif args.preview:
-        preview_file(args.preview)
-    elif args.init:
-        init_infrastructure()
-    elif args.manifest:
-        deploy_manifest(args.manifest)
-    else:
-        deploy_all_manifests()
+    mode = ("fleet" if args.fleet else "preview" if args.preview else "init" if args.init
+            else f"deploy {args.manifest}" if args.manifest else "deploy all")
+    try:
+        with trace_span(f"deploy.py {mode}") as root:
+            if not (args.fleet or args.preview):
+                print(f"Using {set_cluster_backend(args.backend, args.jobs, args.force_conflicts).name} cluster backend")
+
+            if args.fleet:
+                create_production_files_and_push()
+            elif args.preview:
+                preview_file(args.preview)
+            elif args.init:
+                init_infrastructure()
+            elif args.manifest:
+                if not deploy_manifest(args.manifest, changed_only=args.changed_only, force=args.force,
+                                       wait=args.wait, wait_timeout=args.wait_timeout):
+                    root.status = "failed"
+            else:
+                if not deploy_all_manifests(jobs=args.jobs, changed_only=args.changed_only, force=args.force,
+                                            wait=args.wait, wait_timeout=args.wait_timeout, batch=args.batch):
+                    root.status = "failed"
+    finally:
+        if args.trace:
+            print_trace(_trace_root)
+        if args.report:
+            write_trace_report(_trace_root, args.report)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
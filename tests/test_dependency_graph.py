@@ -0,0 +1,172 @@
+#!/usr/bin/python3
+"""
+Tests of the manifest dependency graph of deploy.py: default edges by numeric
+prefix, '# dependsOn:' headers, dependency levels and the concurrent apply
+order, including failed and circular dependencies.
+
+Usage:
+    python -m pytest tests/
+"""
+import sys
+import tempfile
+import threading
+import unittest
+from pathlib import Path
+from contextlib import redirect_stdout
+from io import StringIO
+from unittest import mock
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(REPO_ROOT))
+
+import deploy  # noqa: E402
+
+
+def configmap(name, header=""):
+    return f"""{header}apiVersion: v1
+kind: ConfigMap
+metadata:
+  name: {name}
+data:
+  key: value
+"""
+
+
+class FakeBackend:
+    """Cluster backend recording the applied manifests; fails those in `failing`"""
+    name = "fake"
+
+    def __init__(self, failing=()):
+        self.applied = []
+        self.failing = set(failing)
+        self.lock = threading.Lock()
+
+    def apply(self, content, source):
+        with self.lock:
+            self.applied.append(Path(source).name)
+        return Path(source).name not in self.failing
+
+
+class DependencyGraphTest(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.dir = Path(tmp.name)
+        for name, value in (("DEPLOY_STATE_DIR", self.dir / ".deploy-state"),
+                            ("_cluster_identity", ("test", "https://test:6443", "default"))):
+            patch = mock.patch.object(deploy, name, value)
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def manifest(self, filename, header=""):
+        path = self.dir / filename
+        path.write_text(configmap(path.stem, header))
+        return str(path)
+
+    def names(self, manifests):
+        return sorted(Path(m).name for m in manifests)
+
+    def graph(self, manifests):
+        with redirect_stdout(StringIO()) as out:
+            graph = deploy.build_dependency_graph(manifests)
+        self.output = out.getvalue()
+        return {Path(m).name: self.names(deps) for m, deps in graph.items()}
+
+    def test_default_edges_follow_prefixes(self):
+        manifests = [self.manifest("01-db.yaml"), self.manifest("02-cache.yaml"),
+                     self.manifest("02-queue.yaml"), self.manifest("extra.yaml")]
+        self.assertEqual(self.graph(manifests), {
+            "01-db.yaml": [],
+            "02-cache.yaml": ["01-db.yaml"],
+            "02-queue.yaml": ["01-db.yaml"],
+            "extra.yaml": ["01-db.yaml", "02-cache.yaml", "02-queue.yaml"],
+        })
+
+    def test_depends_on_header(self):
+        manifests = [
+            self.manifest("01-db.yaml", "# dependsOn: none\n"),
+            self.manifest("02-cache.yaml", "# dependsOn: none\n"),
+            self.manifest("03-app.yaml", "# ====\n# App\n# ====\n\n# dependsOn: 02\n"),
+            self.manifest("04-job.yaml", "# dependsOn: 01, 03 07\n"),
+        ]
+        self.assertEqual(self.graph(manifests), {
+            "01-db.yaml": [],
+            "02-cache.yaml": [],
+            "03-app.yaml": ["02-cache.yaml"],
+            "04-job.yaml": ["01-db.yaml", "03-app.yaml"],
+        })
+        self.assertIn("depends on 07, which is not being deployed", self.output)
+
+    def test_depends_on_outside_the_header_is_ignored(self):
+        db = self.manifest("01-db.yaml")
+        body = self.dir / "02-proxy.yaml"
+        body.write_text(
+            "apiVersion: v1\nkind: ConfigMap\nmetadata:\n  name: proxy\ndata:\n"
+            "  run.sh: |\n# dependsOn: none\n    echo start\n"
+        )
+        after_separator = self.dir / "03-app.yaml"
+        after_separator.write_text("# App\n---\n# dependsOn: none\n" + configmap("app"))
+        self.assertEqual(self.graph([db, str(body), str(after_separator)]), {
+            "01-db.yaml": [],
+            "02-proxy.yaml": ["01-db.yaml"],
+            "03-app.yaml": ["01-db.yaml", "02-proxy.yaml"],
+        })
+
+    def test_dependency_levels_and_cycles(self):
+        levels, cyclic = deploy.dependency_levels({
+            "a": set(), "b": {"a"}, "c": {"a"}, "d": {"b", "c"},
+        })
+        self.assertEqual(levels, [["a"], ["b", "c"], ["d"]])
+        self.assertEqual(cyclic, [])
+
+        levels, cyclic = deploy.dependency_levels({
+            "a": set(), "b": {"a", "c"}, "c": {"b"}, "d": {"c"},
+        })
+        self.assertEqual(levels, [["a"]])
+        self.assertEqual(cyclic, ["b", "c", "d"])
+
+    def apply_all(self, manifests, backend):
+        with mock.patch.object(deploy, "_cluster_backend", backend), redirect_stdout(StringIO()):
+            return deploy.apply_manifests(manifests, {}, jobs=4)
+
+    def test_apply_respects_dependencies(self):
+        manifests = [
+            self.manifest("01-db.yaml", "# dependsOn: none\n"),
+            self.manifest("02-index.yaml", "# dependsOn: none\n"),
+            self.manifest("03-app.yaml", "# dependsOn: 01, 02\n"),
+            self.manifest("04-job.yaml", "# dependsOn: 03\n"),
+        ]
+        backend = FakeBackend()
+        self.assertTrue(self.apply_all(manifests, backend))
+        order = backend.applied
+        self.assertEqual(sorted(order[:2]), ["01-db.yaml", "02-index.yaml"])
+        self.assertEqual(order[2:], ["03-app.yaml", "04-job.yaml"])
+
+    def test_apply_skips_dependents_of_failures(self):
+        manifests = [
+            self.manifest("01-db.yaml", "# dependsOn: none\n"),
+            self.manifest("02-index.yaml", "# dependsOn: none\n"),
+            self.manifest("03-app.yaml", "# dependsOn: 01\n"),
+            self.manifest("04-job.yaml", "# dependsOn: 03\n"),
+            self.manifest("05-web.yaml", "# dependsOn: 02\n"),
+        ]
+        backend = FakeBackend(failing={"01-db.yaml"})
+        self.assertFalse(self.apply_all(manifests, backend))
+        self.assertEqual(sorted(backend.applied), ["01-db.yaml", "02-index.yaml", "05-web.yaml"])
+
+    def test_apply_reports_circular_dependencies(self):
+        manifests = [
+            self.manifest("01-db.yaml", "# dependsOn: none\n"),
+            self.manifest("02-app.yaml", "# dependsOn: 01, 03\n"),
+            self.manifest("03-job.yaml", "# dependsOn: 02\n"),
+        ]
+        backend = FakeBackend()
+        with mock.patch.object(deploy, "_cluster_backend", backend), \
+                redirect_stdout(StringIO()) as out:
+            self.assertFalse(deploy.apply_manifests(manifests, {}, jobs=2))
+        self.assertEqual(backend.applied, ["01-db.yaml"])
+        self.assertIn("Circular dependsOn declarations", out.getvalue())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,107 @@
+#!/usr/bin/python3
+"""
+Tests of the --changed-only deploy state of deploy.py: a manifest is
+unchanged only for the same rendered content applied to the same cluster.
+
+Usage:
+    python -m pytest tests/
+"""
+import os
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+from contextlib import redirect_stdout
+from io import StringIO
+from unittest import mock
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(REPO_ROOT))
+
+import deploy  # noqa: E402
+
+KUBECONFIG = """\
+apiVersion: v1
+current-context: {context}
+contexts:
+- name: production
+  context: {{cluster: production, user: admin}}
+- name: staging
+  context: {{cluster: staging, user: admin, namespace: staging}}
+clusters:
+- name: production
+  cluster: {{server: "https://production.example.org:6443"}}
+- name: staging
+  cluster: {{server: "https://staging.example.org:6443"}}
+users:
+- name: admin
+  user: {{token: secret}}
+"""
+
+MANIFEST = """\
+apiVersion: v1
+kind: ConfigMap
+metadata:
+  name: settings
+data:
+  LOG_LEVEL: ${LOG_LEVEL}
+"""
+
+
+class DeployStateTest(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.dir = Path(tmp.name)
+        self.manifest = self.dir / "01-settings.yaml"
+        self.manifest.write_text(MANIFEST)
+        self.kubeconfig = self.dir / "kubeconfig"
+        self.use_context("production")
+
+        patches = [
+            mock.patch.object(deploy, "DEPLOY_STATE_DIR", self.dir / ".deploy-state"),
+            mock.patch.dict(os.environ, {"KUBECONFIG": str(self.kubeconfig)}),
+        ]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+        self.addCleanup(setattr, deploy, "_cluster_identity", None)
+
+    def use_context(self, context):
+        self.kubeconfig.write_text(KUBECONFIG.format(context=context))
+        deploy._cluster_identity = None
+
+    def deploy(self, env_vars):
+        """Render with --changed-only and record the apply when not skipped; return the status"""
+        with redirect_stdout(StringIO()):
+            _, content_hash, skip = deploy.render_manifest(self.manifest, env_vars, changed_only=True)
+            if skip:
+                return skip[0]
+            deploy.record_deploy_state(self.manifest, content_hash)
+        return "applied"
+
+    def test_cluster_identity(self):
+        self.assertEqual(deploy.cluster_identity(),
+                         ("production", "https://production.example.org:6443", "default"))
+        self.use_context("staging")
+        self.assertEqual(deploy.cluster_identity(),
+                         ("staging", "https://staging.example.org:6443", "staging"))
+
+    def test_unchanged_on_the_same_cluster(self):
+        self.assertEqual(self.deploy({"LOG_LEVEL": "INFO"}), "applied")
+        self.assertEqual(self.deploy({"LOG_LEVEL": "INFO"}), "unchanged")
+        self.assertEqual(self.deploy({"LOG_LEVEL": "DEBUG"}), "applied")
+
+    def test_changed_on_another_cluster(self):
+        self.assertEqual(self.deploy({"LOG_LEVEL": "INFO"}), "applied")
+        self.use_context("staging")
+        self.assertEqual(self.deploy({"LOG_LEVEL": "INFO"}), "applied")
+        self.assertEqual(self.deploy({"LOG_LEVEL": "INFO"}), "unchanged")
+
+        state = deploy.read_deploy_state(self.manifest)
+        self.assertEqual((state["context"], state["server"], state["namespace"]),
+                         ("staging", "https://staging.example.org:6443", "staging"))
+
+
+if __name__ == "__main__":
+    unittest.main()
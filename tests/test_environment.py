@@ -0,0 +1,123 @@
+#!/usr/bin/python3
+"""
+Tests of .env loading in deploy.py: inline comments and '#' inside values,
+quoting, computed variables resolved in dependency order, circular
+references and the per-process cache.
+
+Usage:
+    python -m pytest tests/
+"""
+import os
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+from contextlib import redirect_stdout
+from io import StringIO
+from unittest import mock
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(REPO_ROOT))
+
+import deploy  # noqa: E402
+
+
+class StripInlineCommentTest(unittest.TestCase):
+    def test_comment_after_whitespace(self):
+        self.assertEqual(deploy._strip_inline_comment("1.0.4   # proxy version"), "1.0.4")
+        self.assertEqual(deploy._strip_inline_comment("redis_api_cache\t# NFS subpath"), "redis_api_cache")
+
+    def test_hash_inside_unquoted_value(self):
+        self.assertEqual(deploy._strip_inline_comment("#abc"), "#abc")
+        self.assertEqual(deploy._strip_inline_comment("pa#ss#word"), "pa#ss#word")
+        self.assertEqual(deploy._strip_inline_comment("https://example.org/#top"), "https://example.org/#top")
+
+    def test_hash_inside_quotes(self):
+        self.assertEqual(deploy._strip_inline_comment('"0 2 * * *"          # Cron schedule'), '"0 2 * * *"')
+        self.assertEqual(deploy._strip_inline_comment("'a # b' # c"), "'a # b'")
+        self.assertEqual(deploy._strip_inline_comment('"# not a comment"'), '"# not a comment"')
+
+    def test_split_expression(self):
+        self.assertEqual(deploy._split_expression("'http://' + HOST + ':80'"), ["'http://'", "HOST", "':80'"])
+        self.assertEqual(deploy._split_expression("'a + b'"), None)
+        self.assertEqual(deploy._split_expression("a+b=c"), None)
+        self.assertEqual(deploy._split_expression("plain"), None)
+
+
+class LoadEnvironmentTest(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.env_file = Path(tmp.name) / ".env"
+        patch = mock.patch.object(deploy, "_environment_cache", None)
+        patch.start()
+        self.addCleanup(patch.stop)
+
+    def load(self, text):
+        self.env_file.write_text(text)
+        with redirect_stdout(StringIO()) as out:
+            env_vars = deploy.load_environment(str(self.env_file))
+        self.output = out.getvalue()
+        return env_vars
+
+    def test_values_and_comments(self):
+        env_vars = self.load(
+            "# OpenCitations\n"
+            "\n"
+            "VERSION=1.0.4   # image tag\n"
+            "REDIS_PWD=#s3cret#\n"
+            "SCHEDULE=\"0 2 * * *\"          # every day\n"
+            "SPACED = value\n"
+            "EQUALS=a=b\n"
+        )
+        self.assertEqual(env_vars, {
+            "VERSION": "1.0.4",
+            "REDIS_PWD": "#s3cret#",
+            "SCHEDULE": '"0 2 * * *"',
+            "SPACED": "value",
+            "EQUALS": "a=b",
+        })
+
+    def test_computed_variables_in_dependency_order(self):
+        env_vars = self.load(
+            "URL = 'http://' + HOST + ':' + PORT\n"
+            "HOST = SERVICE + '.default.svc.cluster.local'\n"
+            "SERVICE=qlever-service\n"
+            "PORT=7011\n"
+            "LABEL='a + b'\n"
+        )
+        self.assertEqual(env_vars["HOST"], "qlever-service.default.svc.cluster.local")
+        self.assertEqual(env_vars["URL"], "http://qlever-service.default.svc.cluster.local:7011")
+        self.assertEqual(env_vars["LABEL"], "'a + b'")
+
+    def test_later_definition_wins(self):
+        env_vars = self.load("VERSION='v' + N\nN=1\nVERSION=1.0.3\n")
+        self.assertEqual(env_vars["VERSION"], "1.0.3")
+
+    def test_missing_reference_warns(self):
+        env_vars = self.load("URL='http://' + HOST\n")
+        self.assertEqual(env_vars["URL"], "http://")
+        self.assertIn("Variable HOST referenced in URL not found", self.output)
+
+    def test_circular_reference_is_an_error(self):
+        self.env_file.write_text("A='x' + B\nB='y' + C\nC='z' + A\nD=1\n")
+        with self.assertRaises(SystemExit) as raised, redirect_stdout(StringIO()) as out:
+            deploy.load_environment(str(self.env_file))
+        self.assertEqual(raised.exception.code, 1)
+        self.assertIn("Circular reference between computed variables: A -> B -> C -> A", out.getvalue())
+
+    def test_cached_until_the_file_changes(self):
+        first = self.load("VERSION=1\n")
+        first["VERSION"] = "modified by the caller"
+        with redirect_stdout(StringIO()):
+            self.assertEqual(deploy.load_environment(str(self.env_file)), {"VERSION": "1"})
+
+        self.env_file.write_text("VERSION=2\n")
+        stat = self.env_file.stat()
+        os.utime(self.env_file, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+        with redirect_stdout(StringIO()):
+            self.assertEqual(deploy.load_environment(str(self.env_file)), {"VERSION": "2"})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,233 @@
+#!/usr/bin/python3
+"""
+Tests of the in-process Kubernetes API backend of deploy.py against a stub
+API server (discovery, server-side apply with field conflicts, hand-over of
+client-side apply fields) and a stub host serving remote manifests.
+
+Usage:
+    python -m pytest tests/
+"""
+import sys
+import json
+import threading
+import unittest
+from pathlib import Path
+from contextlib import redirect_stdout
+from io import StringIO
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(REPO_ROOT))
+
+import deploy  # noqa: E402
+
+TOKEN = "stub-token"
+
+DISCOVERY = {
+    "/api/v1": {"resources": [
+        {"name": "configmaps", "kind": "ConfigMap", "namespaced": True},
+        {"name": "namespaces", "kind": "Namespace", "namespaced": False},
+    ]},
+}
+
+MANIFEST = """\
+apiVersion: v1
+kind: ConfigMap
+metadata:
+  name: settings
+data:
+  LOG_LEVEL: INFO
+---
+apiVersion: v1
+kind: Namespace
+metadata:
+  name: metallb-system
+"""
+
+
+CSA_CONFIGMAP = {
+    "apiVersion": "v1",
+    "kind": "ConfigMap",
+    "metadata": {
+        "name": "settings",
+        "namespace": "default",
+        "resourceVersion": "41",
+        "managedFields": [
+            {"manager": "kubectl-client-side-apply", "operation": "Update", "apiVersion": "v1",
+             "time": "2025-01-01T00:00:00Z", "fieldsType": "FieldsV1",
+             "fieldsV1": {"f:data": {".": {}, "f:LOG_LEVEL": {}},
+                          "f:metadata": {"f:annotations": {".": {}}}}},
+            {"manager": "kube-controller-manager", "operation": "Update", "apiVersion": "v1",
+             "time": "2025-01-01T00:00:00Z", "fieldsType": "FieldsV1",
+             "fieldsV1": {"f:metadata": {"f:labels": {"f:owner": {}}}}},
+        ],
+    },
+    "data": {"LOG_LEVEL": "DEBUG"},
+}
+
+
+class StubServer:
+    """
+    HTTP server recording requests. `objects` holds existing objects by path;
+    server-side apply answers 409 unless forced for paths in `conflicts` and
+    for objects with fields still owned by client-side apply.
+    """
+
+    def __init__(self):
+        self.requests = []
+        self.conflicts = set()
+        self.objects = {}
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def _reply(self, status, payload, content_type="application/json"):
+                body = payload if isinstance(payload, bytes) else json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                url = urlsplit(self.path)
+                stub.requests.append(("GET", url.path, parse_qs(url.query), dict(self.headers), None))
+                if url.path in DISCOVERY:
+                    self._reply(200, DISCOVERY[url.path])
+                elif url.path in stub.objects:
+                    self._reply(200, stub.objects[url.path])
+                elif url.path == "/metallb-native.yaml":
+                    self._reply(200, MANIFEST.encode(), "text/plain")
+                else:
+                    self._reply(404, {"message": "not found"})
+
+            def do_PATCH(self):
+                url = urlsplit(self.path)
+                query = parse_qs(url.query)
+                body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+                stub.requests.append(("PATCH", url.path, query, dict(self.headers), body))
+                obj = stub.objects.get(url.path)
+                if self.headers["Content-Type"] == "application/json-patch+json":
+                    test, replace = body
+                    if test["value"] != obj["metadata"]["resourceVersion"]:
+                        self._reply(422, {"message": "the test operation failed"})
+                        return
+                    obj["metadata"]["managedFields"] = replace["value"]
+                    self._reply(200, obj)
+                    return
+                managers = [entry["manager"] for entry in (obj or {}).get("metadata", {}).get("managedFields", [])]
+                conflict = url.path in stub.conflicts or "kubectl-client-side-apply" in managers
+                if conflict and query.get("force") != ["true"]:
+                    self._reply(409, {"message": 'Apply failed with 1 conflict: conflict with "kubectl"'})
+                else:
+                    self._reply(200, body)
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def patches(self):
+        return [r for r in self.requests if r[0] == "PATCH"]
+
+
+class KubeApiBackendTest(unittest.TestCase):
+    def setUp(self):
+        self.api = StubServer()
+        self.addCleanup(self.api.close)
+
+    def backend(self, **kwargs):
+        return deploy.KubeApiBackend(self.api.url, token=TOKEN, **kwargs)
+
+    def apply(self, backend, content=MANIFEST):
+        with redirect_stdout(StringIO()) as out:
+            result = backend.apply(content, "test.yaml")
+        return result, out.getvalue()
+
+    def test_apply_patches_every_document(self):
+        result, _ = self.apply(self.backend())
+        self.assertTrue(result)
+        paths = [r[1] for r in self.api.patches()]
+        self.assertEqual(paths, ["/api/v1/namespaces/default/configmaps/settings",
+                                 "/api/v1/namespaces/metallb-system"])
+        for _, _, query, headers, _ in self.api.patches():
+            self.assertEqual(query["fieldManager"], ["deploy-py"])
+            self.assertEqual(headers["Content-Type"], "application/apply-patch+yaml")
+            self.assertEqual(headers["Authorization"], f"Bearer {TOKEN}")
+
+    def test_apply_does_not_force_by_default(self):
+        self.api.conflicts.add("/api/v1/namespaces/default/configmaps/settings")
+        result, out = self.apply(self.backend())
+        self.assertFalse(result)
+        self.assertNotIn("force", self.api.patches()[0][2])
+        self.assertIn("conflict", out)
+        self.assertIn("--force-conflicts", out)
+
+    def test_apply_forces_conflicts_when_enabled(self):
+        self.api.conflicts.add("/api/v1/namespaces/default/configmaps/settings")
+        result, _ = self.apply(self.backend(force_conflicts=True))
+        self.assertTrue(result)
+        for _, _, query, _, _ in self.api.patches():
+            self.assertEqual(query["force"], ["true"])
+
+    def test_apply_takes_over_client_side_apply_fields(self):
+        path = "/api/v1/namespaces/default/configmaps/settings"
+        self.api.objects[path] = json.loads(json.dumps(CSA_CONFIGMAP))
+        result, out = self.apply(self.backend())
+        self.assertTrue(result, out)
+
+        upgrade, apply = [r for r in self.api.patches() if r[1] == path]
+        self.assertEqual(upgrade[3]["Content-Type"], "application/json-patch+json")
+        self.assertEqual(upgrade[4][0], {"op": "test", "path": "/metadata/resourceVersion", "value": "41"})
+        self.assertNotIn("force", apply[2])
+
+        managed = {entry["manager"]: entry for entry in self.api.objects[path]["metadata"]["managedFields"]}
+        self.assertEqual(set(managed), {"deploy-py", "kube-controller-manager"})
+        self.assertEqual(managed["deploy-py"]["operation"], "Apply")
+        self.assertEqual(managed["deploy-py"]["fieldsV1"],
+                         CSA_CONFIGMAP["metadata"]["managedFields"][0]["fieldsV1"])
+
+    def test_apply_leaves_server_side_objects_alone(self):
+        path = "/api/v1/namespaces/default/configmaps/settings"
+        obj = json.loads(json.dumps(CSA_CONFIGMAP))
+        obj["metadata"]["managedFields"][0].update(manager="deploy-py", operation="Apply")
+        self.api.objects[path] = obj
+        result, _ = self.apply(self.backend())
+        self.assertTrue(result)
+        self.assertEqual([r[3]["Content-Type"] for r in self.api.patches() if r[1] == path],
+                         ["application/apply-patch+yaml"])
+
+    def test_default_backend_is_kubectl(self):
+        self.addCleanup(setattr, deploy, "_cluster_backend", deploy._cluster_backend)
+        deploy._cluster_backend = None
+        self.assertEqual(deploy.get_cluster_backend().name, "kubectl")
+
+    def test_apply_url_downloads_without_cluster_credentials(self):
+        remote = StubServer()
+        self.addCleanup(remote.close)
+        backend = self.backend()
+
+        with redirect_stdout(StringIO()):
+            self.assertTrue(backend.apply_url(f"{remote.url}/metallb-native.yaml"))
+
+        download = remote.requests[0]
+        self.assertEqual(download[1], "/metallb-native.yaml")
+        self.assertNotIn("Authorization", download[3])
+        self.assertEqual(len(self.api.patches()), 2)
+        self.assertEqual(self.api.patches()[0][3]["Authorization"], f"Bearer {TOKEN}")
+
+    def test_exists(self):
+        backend = self.backend()
+        self.assertFalse(backend.namespace_exists("metallb-system"))
+        self.assertEqual(self.api.requests[-1][1], "/api/v1/namespaces/metallb-system")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,104 @@
+#!/usr/bin/python3
+"""
+Tests of the template rendering of deploy.py: ${VAR} substitution, quote
+stripping, unresolved placeholders versus shell variables assigned in the
+file, and the compiled template cache.
+
+Usage:
+    python -m pytest tests/
+"""
+import os
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(REPO_ROOT))
+
+import deploy  # noqa: E402
+
+TEMPLATE = """\
+apiVersion: batch/v1
+kind: CronJob
+metadata:
+  name: ${NAME}-backup
+spec:
+  schedule: ${SCHEDULE}
+  jobTemplate:
+    spec:
+      template:
+        spec:
+          containers:
+          - name: backup
+            image: ${IMAGE}:${VERSION}
+            env:
+            - name: SPARQL_ENDPOINT_INDEX
+              value: "${SPARQL_ENDPOINT_INDEX}"
+            command:
+            - /bin/sh
+            - -c
+            - |
+              NFS_ROOT="/mnt/nfs"
+              export BACKUP_DIR="${NFS_ROOT}/backup"; mkdir -p ${BACKUP_DIR}
+              echo "$1 ${1}" > ${BACKUP_DIR}/done
+"""
+
+
+class TemplateTest(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.path = Path(tmp.name) / "05-backup.yaml"
+        self.path.write_text(TEMPLATE)
+
+    def render(self, env_vars):
+        return deploy.render_template(self.path, env_vars)
+
+    def test_substitutes_env_vars(self):
+        content, used, unresolved = self.render({
+            "NAME": "wp", "SCHEDULE": '"0 2 * * *"', "IMAGE": "'opencitations/backup'",
+            "VERSION": "1.2.0", "SPARQL_ENDPOINT_INDEX": "http://qlever:7011", "UNUSED": "x",
+        })
+        self.assertIn("name: wp-backup\n", content)
+        self.assertIn("schedule: 0 2 * * *\n", content)
+        self.assertIn("image: opencitations/backup:1.2.0\n", content)
+        self.assertIn('value: "http://qlever:7011"\n', content)
+        self.assertEqual(used, {"NAME", "SCHEDULE", "IMAGE", "VERSION", "SPARQL_ENDPOINT_INDEX"})
+        self.assertEqual(unresolved, set())
+
+    def test_shell_variables_are_left_for_the_shell(self):
+        content, _, unresolved = self.render({})
+        self.assertIn('export BACKUP_DIR="${NFS_ROOT}/backup"; mkdir -p ${BACKUP_DIR}\n', content)
+        self.assertIn('echo "$1 ${1}" > ${BACKUP_DIR}/done\n', content)
+        self.assertNotIn("NFS_ROOT", unresolved)
+        self.assertNotIn("BACKUP_DIR", unresolved)
+        self.assertNotIn("1", unresolved)
+
+    def test_container_env_names_are_not_local_definitions(self):
+        _, _, unresolved = self.render({"NAME": "wp", "SCHEDULE": "x", "IMAGE": "i", "VERSION": "1"})
+        self.assertEqual(unresolved, {"SPARQL_ENDPOINT_INDEX"})
+        content, _, _ = self.render({})
+        self.assertIn("name: ${NAME}-backup\n", content)
+
+    def test_only_surrounding_quotes_are_stripped(self):
+        content, _, _ = self.render({"NAME": "'a'b'", "SCHEDULE": '"x', "IMAGE": "'", "VERSION": '""'})
+        self.assertIn("name: a'b-backup\n", content)
+        self.assertIn('schedule: "x\n', content)
+        self.assertIn("image: ':\n", content)
+
+    def test_compiled_template_is_cached_until_the_file_changes(self):
+        compiled = deploy.compile_template(self.path)
+        self.assertIs(deploy.compile_template(self.path), compiled)
+
+        # Same size, later modification time
+        self.path.write_text(TEMPLATE.replace("${NAME}-backup", "${NAME}-restor"))
+        stat = self.path.stat()
+        os.utime(self.path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+        self.assertIsNot(deploy.compile_template(self.path), compiled)
+        content, _, _ = self.render({"NAME": "wp"})
+        self.assertIn("name: wp-restor\n", content)
+
+
+if __name__ == "__main__":
+    unittest.main()
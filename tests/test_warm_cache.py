@@ -0,0 +1,269 @@
+#!/usr/bin/python3
+"""
+Tests of the Redis API cache warmer (docs/oc-api-redis-cache.md) against the
+real proxy, a stub oc-api backend and the in-memory Redis stand-in of
+benchmarks/bench_api_cache.py: ranking of the access logs, the concurrency
+and miss budget caps, resuming from a checkpoint and discarding a checkpoint
+ranked from other logs.
+
+Requires the proxy dependencies: pip install "aiohttp>=3.10,<4" "redis[hiredis]>=5.0,<6"
+
+Usage:
+    python -m pytest tests/
+"""
+import os
+import re
+import sys
+import gzip
+import json
+import asyncio
+import tempfile
+import threading
+import unittest
+from pathlib import Path
+from contextlib import redirect_stdout
+from io import StringIO
+from unittest import mock
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(REPO_ROOT / "benchmarks"))
+
+try:
+    import aiohttp
+    import hiredis  # noqa: F401
+    import redis  # noqa: F401
+    from aiohttp import web
+except ImportError:
+    aiohttp = None
+else:
+    from bench_api_cache import PROXY_DOC, free_port, start, stop, wait_http
+
+BACKEND_LATENCY = 0.05
+
+# (path?query as logged, requests): ranked by the canonical form of the path
+TRAFFIC = [
+    ("/index/v2/citations/doi:10.1/A", 30),
+    ("/index/v2/citations/DOI:10.1/a", 20),  # same canonical URL as the first
+    ("/meta/v1/metadata/doi:10.2/b?require=title&format=json", 40),
+    ("/index/v2/references/doi:10.3/c", 35),
+    ("/index/v2/citation-count/doi:10.4/d", 10),
+    ("/index/v2/references/doi:10.5/e", 9),
+    ("/index/v2/references/doi:10.6/f", 8),
+    ("/index/v2/references/doi:10.7/g", 7),
+    ("/index/v2/references/doi:10.8/h", 6),
+    ("/index/v2/references/doi:10.9/i", 5),
+    ("/index/v2/references/doi:10.10/j", 4),
+    ("/index/v2/references/doi:10.11/k", 3),
+    ("/index/v2/references/doi:10.12/l", 2),
+]
+
+RANKING = [
+    "/index/v2/citations/doi:10.1/a",
+    "/meta/v1/metadata/doi:10.2/b?format=json&require=title",
+    "/index/v2/references/doi:10.3/c",
+    "/index/v2/citation-count/doi:10.4/d",
+    "/index/v2/references/doi:10.5/e",
+    "/index/v2/references/doi:10.6/f",
+    "/index/v2/references/doi:10.7/g",
+    "/index/v2/references/doi:10.8/h",
+    "/index/v2/references/doi:10.9/i",
+    "/index/v2/references/doi:10.10/j",
+    "/index/v2/references/doi:10.11/k",
+    "/index/v2/references/doi:10.12/l",
+]
+
+# Requests not counted: other methods, statuses, hosts, paths and previews
+IGNORED = [
+    {"RequestMethod": "POST", "RequestPath": "/index/v2/references/doi:10.99/z"},
+    {"DownstreamStatus": 404, "RequestPath": "/index/v2/references/doi:10.99/z"},
+    {"RequestHost": "opencitations.net", "RequestPath": "/index/v2/references/doi:10.99/z"},
+    {"RequestPath": "/index/search?text=z"},
+    {"RequestPath": "/index/v2/references/doi:10.99/z?preview=true"},
+]
+
+
+def log_record(**fields):
+    return {"RequestMethod": "GET", "DownstreamStatus": 200, "RequestHost": "api.opencitations.net",
+            "request_Accept": "application/json", **fields}
+
+
+def write_log(path, traffic, extra=()):
+    """Traefik JSON access log with `requests` lines per path, interleaved; gzipped for .gz"""
+    records = [log_record(RequestPath=url) for url, requests in traffic for _ in range(requests)]
+    records = records[::2] + records[1::2] + [log_record(**fields) for fields in extra]
+    lines = "".join(json.dumps(record) + "\n" for record in records) + "not json\n"
+    if str(path).endswith(".gz"):
+        with gzip.open(path, "wt") as f:
+            f.write(lines)
+    else:
+        Path(path).write_text(lines)
+
+
+def extract_sources(target):
+    """Write proxy.py and warm_cache.py from their source blocks in the documentation"""
+    text = PROXY_DOC.read_text()
+    for name in ("proxy.py", "warm_cache.py"):
+        match = re.search(rf"^### {re.escape(name)}\s*\n+```python\n(.*?)^```", text, re.MULTILINE | re.DOTALL)
+        (target / name).write_text(match.group(1))
+
+
+class StubBackend(threading.Thread):
+    """oc-api stub answering every GET with a small JSON body; records paths and peak concurrency"""
+
+    def __init__(self, port):
+        super().__init__(daemon=True)
+        self.port = port
+        self.paths = []
+        self.inflight = self.peak = 0
+        self.ready = threading.Event()
+
+    def reset(self):
+        self.paths.clear()
+        self.peak = 0
+
+    async def handle(self, request):
+        self.paths.append(request.path_qs)
+        self.inflight += 1
+        self.peak = max(self.peak, self.inflight)
+        try:
+            await asyncio.sleep(BACKEND_LATENCY)
+        finally:
+            self.inflight -= 1
+        return web.json_response([{"path": request.path}])
+
+    def run(self):
+        async def serve():
+            app = web.Application()
+            app.router.add_route("*", "/{path:.*}", self.handle)
+            runner = web.AppRunner(app, access_log=None)
+            await runner.setup()
+            await web.TCPSite(runner, "127.0.0.1", self.port).start()
+            self.ready.set()
+            await asyncio.Event().wait()
+
+        asyncio.run(serve())
+
+
+@unittest.skipIf(aiohttp is None, "the proxy dependencies (aiohttp, redis, hiredis) are not installed")
+class WarmCacheTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        tmp = tempfile.TemporaryDirectory()
+        cls.addClassCleanup(tmp.cleanup)
+        cls.sources = Path(tmp.name)
+        extract_sources(cls.sources)
+        sys.path.insert(0, str(cls.sources))
+        cls.addClassCleanup(sys.path.remove, str(cls.sources))
+        import warm_cache
+        cls.warm_cache = warm_cache
+
+        cls.backend = StubBackend(free_port())
+        cls.backend.start()
+        cls.backend.ready.wait(10)
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.dir = Path(tmp.name)
+        self.log = self.dir / "oc-2025-05.log.gz"
+        write_log(self.log, TRAFFIC, IGNORED)
+        self.checkpoint = self.dir / "checkpoint.json"
+        self.backend.reset()
+        self.start_proxy()
+
+    def start_proxy(self):
+        """Start a cold proxy and Redis stand-in for the test"""
+        log = open(self.dir / "services.log", "w")
+        self.addCleanup(log.close)
+        redis_port, proxy_port = free_port(), free_port()
+        redis_server = start([sys.executable, str(REPO_ROOT / "benchmarks" / "bench_api_cache.py"),
+                              "--stub-redis", str(redis_port)], log)
+        self.addCleanup(stop, redis_server)
+        env = dict(os.environ, REDIS_HOST="127.0.0.1", REDIS_PORT=str(redis_port),
+                   BACKEND_HOST="127.0.0.1", BACKEND_PORT=str(self.backend.port),
+                   LISTEN_PORT=str(proxy_port), WORKERS="1", LOG_LEVEL="WARNING")
+        env.pop("SNAPSHOT_PATH", None)
+        proxy = start([sys.executable, str(self.sources / "proxy.py")], log, env)
+        self.addCleanup(stop, proxy)
+        self.proxy_url = f"http://127.0.0.1:{proxy_port}"
+        wait_http(self.proxy_url + "/healthz")
+
+    def warm(self, *args, logs=None):
+        """Run warm_cache.py with `args`; return the JSON summary (or the printed lines with --dry-run)"""
+        argv = ["warm_cache.py", *(str(log) for log in logs or [self.log]), "--proxy-url", self.proxy_url,
+                "--host", "api.opencitations.net", "--rate", "0", "--checkpoint", str(self.checkpoint), *args]
+        with mock.patch.object(sys, "argv", argv), redirect_stdout(StringIO()) as out:
+            self.status = self.warm_cache.main()
+        if "--dry-run" in args:
+            return [line.split("\t")[0] for line in out.getvalue().splitlines()]
+        return json.loads(out.getvalue())
+
+    def test_ranking_of_canonical_requests(self):
+        plain = self.dir / "oc-2025-06.log"
+        write_log(plain, [("/index/v2/references/doi:10.12/L", 50)])
+        ranking = self.warm_cache.rank_urls([str(self.log), str(plain)], 3, "api.opencitations.net")
+        self.assertEqual(ranking, [
+            ("/index/v2/references/doi:10.12/l", "application/json"),
+            ("/index/v2/citations/doi:10.1/a", "application/json"),
+            ("/meta/v1/metadata/doi:10.2/b?format=json&require=title", "application/json"),
+        ])
+        self.assertEqual(self.warm("--top", "5", "--dry-run"), RANKING[:5])
+        self.assertFalse(self.checkpoint.exists())
+
+    def test_concurrency_and_miss_budget(self):
+        summary = self.warm("--top", "12", "--concurrency", "3", "--miss-budget", "4")
+        self.assertFalse(summary["completed"])
+        self.assertEqual(self.status, 0)  # stopping at the budget is not a failure
+        self.assertLessEqual(self.backend.peak, 3)
+        self.assertGreater(self.backend.peak, 1)
+        self.assertGreaterEqual(len(self.backend.paths), 4)
+        self.assertLessEqual(len(self.backend.paths), 4 + 3 - 1)
+        self.assertEqual(summary["miss"], len(self.backend.paths))
+
+        # The most requested URLs are warmed first
+        state = json.loads(self.checkpoint.read_text())
+        self.assertEqual([url for url, _ in state["ranking"]], RANKING)
+        self.assertEqual(state["done"], list(range(summary["done"])))
+
+    def test_resume_from_checkpoint(self):
+        first = self.warm("--top", "12", "--concurrency", "2", "--miss-budget", "5")
+        self.assertFalse(first["completed"])
+        fetched = list(self.backend.paths)
+
+        second = self.warm("--top", "12", "--concurrency", "2", "--miss-budget", "100")
+        self.assertTrue(second["completed"])
+        self.assertEqual(second["done"], len(RANKING))
+        self.assertEqual(second["miss"], len(RANKING) - first["done"])
+        self.assertNotIn("hit", second)  # URLs done in the first run are not requested again
+        self.assertEqual(sorted(self.backend.paths), sorted(RANKING))
+        self.assertEqual(len(set(self.backend.paths) & set(fetched)), len(fetched))
+        self.assertFalse(self.checkpoint.exists())
+
+    def test_checkpoint_of_other_logs_is_discarded(self):
+        self.warm("--top", "12", "--concurrency", "1", "--miss-budget", "2")
+        self.assertTrue(self.checkpoint.exists())
+
+        # A new month is added: the ranking is made again from the new log files
+        newer = self.dir / "oc-2025-06.log.gz"
+        write_log(newer, [("/index/v2/citation-count/doi:10.4/D", 100)])
+        ranking = self.warm("--top", "3", "--dry-run", logs=[self.log, newer])
+        self.assertEqual(ranking, ["/index/v2/citation-count/doi:10.4/d"] + RANKING[:2])
+
+        # The same log file rewritten since the ranking
+        write_log(self.log, TRAFFIC[2:])
+        signature = self.warm_cache.log_signature([str(self.log)])
+        self.assertIsNone(self.warm_cache.load_checkpoint(str(self.checkpoint), signature, 3600))
+        self.assertEqual(self.warm("--top", "1", "--dry-run"), [RANKING[1]])
+
+    def test_stale_checkpoint_is_discarded(self):
+        self.warm("--top", "12", "--concurrency", "1", "--miss-budget", "2")
+        signature = self.warm_cache.log_signature([str(self.log)])
+        self.assertIsNotNone(self.warm_cache.load_checkpoint(str(self.checkpoint), signature, 3600))
+        state = json.loads(self.checkpoint.read_text())
+        state["created_at"] -= 7200
+        self.checkpoint.write_text(json.dumps(state))
+        self.assertIsNone(self.warm_cache.load_checkpoint(str(self.checkpoint), signature, 3600))
+
+
+if __name__ == "__main__":
+    unittest.main()